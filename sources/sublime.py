@@ -1,9 +1,14 @@
 # ST version: 4131
 import collections
+import concurrent.futures
+import heapq
 import html
 import json
 import sys
 import io
+import threading
+import time
+import traceback
 
 import sublime_api
 
@@ -475,11 +480,17 @@ def save_settings(base_name):
     sublime_api.save_settings(base_name)
 
 
+# Set by sublime_plugin.start_stall_watchdog() to watch set_timeout() callbacks
+_main_thread_watchdog = None
+
+
 def set_timeout(f, timeout_ms=0):
     """
     Schedules a function to be called in the future. Sublime Text will block
     while the function is running
     """
+    if _main_thread_watchdog is not None:
+        f = _main_thread_watchdog.wrap(f)
     sublime_api.set_timeout(f, timeout_ms)
 
 
@@ -492,6 +503,202 @@ def set_timeout_async(f, timeout_ms=0):
     sublime_api.set_timeout_async(f, timeout_ms)
 
 
+class _TimerWheel:
+    """
+    Multiplexes many logical timers onto few host timeouts. A host timeout is
+    only requested when a new timer is due before every timeout that has
+    already been requested, so a stream of debounce timers that keep being
+    pushed back costs a single host timeout at a time.
+
+    Cancelled timers are dropped from the heap once they make up half of it,
+    so timers that keep being cancelled and re-added with a long delay don't
+    keep their callbacks alive or grow the heap until they become due.
+    """
+
+    def __init__(self, host_set_timeout):
+        self.host_set_timeout = host_set_timeout
+        self.lock = threading.Lock()
+        # Heap of (deadline, seq, future, f)
+        self.timers = []
+        # The number of cancelled timers left in self.timers
+        self.cancelled = 0
+        # Heap of the deadlines host timeouts have been requested for
+        self.wakeups = []
+        self.seq = 0
+
+    def add(self, f, timeout_ms):
+        future = concurrent.futures.Future()
+        deadline = time.monotonic() + timeout_ms / 1000
+        with self.lock:
+            self.seq += 1
+            heapq.heappush(self.timers, (deadline, self.seq, future, f))
+            arm = not self.wakeups or deadline < self.wakeups[0]
+            if arm:
+                heapq.heappush(self.wakeups, deadline)
+        if arm:
+            self._arm(deadline, timeout_ms)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future):
+        if not future.cancelled():
+            return
+        with self.lock:
+            self.cancelled += 1
+            if self.cancelled * 2 > len(self.timers):
+                self.timers = [t for t in self.timers if not t[2].cancelled()]
+                heapq.heapify(self.timers)
+                self.cancelled = 0
+
+    def _arm(self, deadline, timeout_ms):
+        self.host_set_timeout(lambda: self._fire(deadline), max(timeout_ms, 0))
+
+    def _fire(self, wakeup):
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            self.wakeups.remove(wakeup)
+            heapq.heapify(self.wakeups)
+            while self.timers and (self.timers[0][0] <= now or self.timers[0][2].cancelled()):
+                timer = heapq.heappop(self.timers)
+                if timer[2].cancelled():
+                    self.cancelled -= 1
+                else:
+                    due.append(timer)
+
+            next_deadline = None
+            if self.timers and (not self.wakeups or self.timers[0][0] < self.wakeups[0]):
+                next_deadline = self.timers[0][0]
+                heapq.heappush(self.wakeups, next_deadline)
+
+        if next_deadline is not None:
+            self._arm(next_deadline, int((next_deadline - now) * 1000) + 1)
+
+        for _, _, future, f in due:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(f())
+            except Exception as e:
+                traceback.print_exc()
+                future.set_exception(e)
+
+
+_main_timers = _TimerWheel(lambda f, timeout_ms: set_timeout(f, timeout_ms))
+_async_timers = _TimerWheel(lambda f, timeout_ms: set_timeout_async(f, timeout_ms))
+
+
+def set_timeout_future(f, timeout_ms=0):
+    """
+    Like set_timeout(), but returns a concurrent.futures.Future. Calling
+    cancel() on it before f runs stops f from being run; its result() or
+    exception() is what f returned or raised. Do not wait on result() from
+    the main thread, as f is run there.
+    """
+    return _main_timers.add(f, timeout_ms)
+
+
+def set_timeout_async_future(f, timeout_ms=0):
+    """
+    Like set_timeout_async(), but returns a concurrent.futures.Future. Calling
+    cancel() on it before f runs stops f from being run; its result() or
+    exception() is what f returned or raised.
+    """
+    return _async_timers.add(f, timeout_ms)
+
+
+class _MainThreadBatcher:
+    """
+    Collects callables to be run on the main thread, and runs as many as fit
+    in a time budget in a single set_timeout() tick, instead of each one
+    crossing into the host and getting a UI slice of its own.
+    """
+
+    def __init__(self, budget_ms=10):
+        self.budget_ms = budget_ms
+        self.queue = collections.deque()
+        self.lock = threading.Lock()
+        self.scheduled = False
+        self.max_queue_length = 0
+        self.drains = 0
+        self.drained = 0
+        self.drain_time = 0.0
+        self.max_drain_time = 0.0
+
+    def add(self, f):
+        with self.lock:
+            self.queue.append(f)
+            self.max_queue_length = max(self.max_queue_length, len(self.queue))
+            schedule = not self.scheduled
+            self.scheduled = True
+        if schedule:
+            set_timeout(self._drain)
+
+    def _drain(self):
+        t0 = time.perf_counter()
+        deadline = t0 + self.budget_ms / 1000
+        n = 0
+        # Always run at least one callable, so a tiny budget can't stall
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.scheduled = False
+                    break
+                f = self.queue.popleft()
+            n += 1
+            try:
+                f()
+            except Exception:
+                traceback.print_exc()
+            if time.perf_counter() >= deadline:
+                with self.lock:
+                    if self.queue:
+                        set_timeout(self._drain)
+                    else:
+                        self.scheduled = False
+                break
+
+        elapsed = time.perf_counter() - t0
+        self.drains += 1
+        self.drained += n
+        self.drain_time += elapsed
+        self.max_drain_time = max(self.max_drain_time, elapsed)
+
+    def stats(self):
+        with self.lock:
+            queue_length = len(self.queue)
+        return {
+            'queue_length': queue_length,
+            'max_queue_length': self.max_queue_length,
+            'drains': self.drains,
+            'drained': self.drained,
+            'drain_time': self.drain_time,
+            'max_drain_time': self.max_drain_time,
+        }
+
+
+_main_thread_batcher = _MainThreadBatcher()
+
+
+def set_timeout_batched(f):
+    """
+    Schedules a function to be called on the main thread as soon as possible,
+    batched together with other functions scheduled this way. Batches are run
+    in a single tick, up to a time budget, so this is suited to many small
+    callbacks such as updating the status bar, regions or phantoms.
+    """
+    _main_thread_batcher.add(f)
+
+
+def batched_timeout_stats():
+    """
+    Returns a dict of metrics of set_timeout_batched(): the current and
+    maximum queue length, the number of drain ticks and callables run, and
+    the total and maximum seconds spent draining.
+    """
+    return _main_thread_batcher.stats()
+
+
 def active_window():
     return Window(sublime_api.active_window())
 
@@ -2044,7 +2251,8 @@ class CompletionItem:
         'completion_format',
         'kind',
         'details',
-        'flags'
+        'flags',
+        '_normalised'
     ]
 
     def __init__(
@@ -2063,6 +2271,7 @@ class CompletionItem:
         self.kind = kind
         self.details = details
         self.flags = 0
+        self._normalised = None
 
     def __eq__(self, rhs):
         if self.trigger != rhs.trigger:
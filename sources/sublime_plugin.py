@@ -1,12 +1,20 @@
 # ST version: 4131
+import array
+import asyncio
+import bisect
+import collections
+import concurrent.futures
 import importlib
 import io
+import itertools
 import marshal
+import math
 import os
 import sys
 import threading
 import time
 import traceback
+import types
 import zipfile
 
 import sublime
@@ -22,7 +30,13 @@ window_command_classes = []
 text_command_classes = []
 
 view_event_listener_classes = []
+# view_id -> {ViewEventListener class -> instance}, in instantiation order
 view_event_listeners = {}
+# view_id -> {event name -> tuple of bound ViewEventListener handlers}
+view_event_listener_handlers = {}
+# view_id -> {settings key -> value} of the keys declared by
+# ViewEventListener.applicable_settings_keys()
+view_settings_snapshots = {}
 
 all_command_classes = [
     application_command_classes,
@@ -85,6 +99,10 @@ all_callbacks = {
     'on_exit': [],
 }
 
+# Bound handler callables for each EventListener event, rebuilt whenever a
+# plugin is loaded or unloaded so dispatching doesn't need any getattr() calls
+el_dispatch_tables = {name: () for name in all_callbacks}
+
 pending_on_activated_async_lock = threading.Lock()
 
 pending_on_activated_async_callbacks = {
@@ -131,8 +149,234 @@ text_change_listener_callbacks = {
 }
 text_change_listeners = {}
 
+# TextChangeListener callbacks which receive a TextChangeBatch, rather than a
+# list of TextChange, when the class sets columnar_changes
+columnar_callbacks = {'on_text_changed', 'on_text_changed_async'}
+
+# Async events which fire in bursts while typing, and may be coalesced by
+# decorating the handler with coalesced()
+coalescable_callbacks = {
+    'on_modified_async',
+    'on_selection_modified_async',
+}
+
+# The (view_id, change_count) an async view event was dispatched with, for
+# the handlers of that event running on the current thread
+dispatch_state = threading.local()
+
 profile = {}
 
+# Only time 1 in every N calls of each blocking event handler, for when the
+# overhead of the profiler itself matters
+profile_sample_interval = 1
+
+# The active TraceRecorder, if tracing has been started
+trace_recorder = None
+
+# The running StallWatchdog, if any
+stall_watchdog = None
+
+# The event loop coroutines returned by event handlers, application and window
+# commands and input handlers are run on, started by get_asyncio_loop()
+asyncio_loop = None
+asyncio_loop_lock = threading.Lock()
+
+# The running AsyncHandlerExecutor, if async handlers are dispatched onto a
+# thread pool rather than being run directly on the async worker thread
+async_executor = None
+
+
+class ExceptionReporter:
+    """
+    Prints exceptions raised by event handlers. Each distinct failure is
+    identified by the handler, the exception type and the line that raised
+    it. The full traceback is printed the first time, after which repeats are
+    only counted, and a summary of them is printed periodically.
+    """
+
+    def __init__(self, summary_interval=10.0):
+        """
+        :param summary_interval:
+            The number of seconds between summaries of repeated exceptions
+        """
+
+        self.summary_interval = summary_interval
+        # fingerprint -> total number of occurrences
+        self.seen = {}
+        # fingerprint -> occurrences since the last summary
+        self.repeats = {}
+        self.summary_scheduled = False
+        self.lock = threading.Lock()
+
+    def report(self, name, module, e, include_stack=True):
+        """
+        Must be called from the except block that caught e, so that the
+        frames of the traceback are still available
+
+        :param name:
+            A unicode string of the event handler name
+
+        :param module:
+            A unicode string of the module the event handler is defined in
+
+        :param e:
+            The Exception raised by the event handler
+
+        :param include_stack:
+            If the stack frames leading to the except block should be
+            included in the printed traceback
+        """
+
+        last = e.__traceback__
+        while last.tb_next is not None:
+            last = last.tb_next
+        fingerprint = (
+            module, name, type(e), last.tb_frame.f_code.co_filename, last.tb_lineno)
+
+        schedule = False
+        with self.lock:
+            count = self.seen.get(fingerprint, 0)
+            self.seen[fingerprint] = count + 1
+            if count > 0:
+                self.repeats[fingerprint] = self.repeats.get(fingerprint, 0) + 1
+                schedule = not self.summary_scheduled
+                self.summary_scheduled = True
+
+        if count == 0:
+            # All this to include stack frames before the call to the
+            # event handler
+            tb = traceback.StackSummary()
+            if include_stack:
+                tb = traceback.extract_stack(e.__traceback__.tb_frame.f_back)
+            tb += traceback.extract_tb(e.__traceback__)
+            out = ["Traceback (most recent call last):\n"]
+            out += traceback.format_list(tb)
+            out += traceback.format_exception_only(type(e), e)
+            print("".join(out), end="")
+        elif schedule:
+            sublime.set_timeout_async(
+                self.print_summary, int(self.summary_interval * 1000))
+
+    def print_summary(self):
+        with self.lock:
+            repeats = self.repeats
+            self.repeats = {}
+            self.summary_scheduled = False
+
+        for (module, name, exc_type, filename, lineno), n in repeats.items():
+            print(f"{exc_type.__name__} in {module}.{name} "
+                  f"({filename}:{lineno}) repeated {n} more time(s)")
+
+    def reset(self):
+        """
+        Forget all seen exceptions, so the next occurrence of each prints its
+        full traceback again
+        """
+
+        with self.lock:
+            self.seen.clear()
+            self.repeats.clear()
+
+
+exception_reporter = ExceptionReporter()
+
+
+def get_asyncio_loop():
+    """
+    :return:
+        The asyncio event loop used to run coroutines returned by plugins,
+        which runs on its own thread and is started on first use
+    """
+
+    global asyncio_loop
+    with asyncio_loop_lock:
+        if asyncio_loop is None:
+            asyncio_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=asyncio_loop.run_forever, name='AsyncioLoop', daemon=True).start()
+    return asyncio_loop
+
+
+def run_coroutine(coro, name, module):
+    """
+    Schedules a coroutine on the asyncio loop thread, reporting any exception
+    it raises through exception_reporter
+
+    :param coro:
+        The coroutine object
+
+    :param name:
+        A unicode string of the name of the handler or command that returned
+        the coroutine
+
+    :param module:
+        A unicode string of the module the handler or command is defined in
+
+    :return:
+        A concurrent.futures.Future of the result of the coroutine
+    """
+
+    def done(future):
+        if future.cancelled():
+            return
+        try:
+            future.result()
+        except (Exception) as e:
+            # The stack of the loop thread says nothing about the coroutine
+            exception_reporter.report(name, module, e, include_stack=False)
+
+    future = asyncio.run_coroutine_threadsafe(coro, get_asyncio_loop())
+    future.add_done_callback(done)
+    return future
+
+
+def schedule_if_coroutine(res, name, module):
+    """
+    Runs the result of a handler or command with run_coroutine() if it is a
+    coroutine
+
+    :param res:
+        The value returned by the handler or command
+
+    :param name:
+        A unicode string of the name of the handler or command
+
+    :param module:
+        A unicode string of the module the handler or command is defined in
+
+    :return:
+        None if res was a coroutine, otherwise res
+    """
+
+    if res.__class__ is types.CoroutineType:
+        run_coroutine(res, name, module)
+        return None
+    return res
+
+
+def _copy_handler_attributes(event_handler, wrapper):
+    """
+    Makes the function wrapping an event handler method look like the method,
+    for introspection
+
+    :param event_handler:
+        The event handler method being wrapped
+
+    :param wrapper:
+        The function wrapping it
+
+    :return:
+        wrapper
+    """
+
+    wrapper.__doc__ = event_handler.__doc__
+    wrapper.__name__ = event_handler.__name__
+    wrapper.__module__ = event_handler.__module__
+    wrapper.__dict__.update(event_handler.__dict__)
+    # Follow the pattern of decorators like @classmethod and @staticmethod
+    wrapper.__func__ = event_handler
+    return wrapper
+
 
 def add_profiling(event_handler):
     """
@@ -146,33 +390,39 @@ def add_profiling(event_handler):
         The decorated method
     """
 
+    name = event_handler.__name__
+    mod = event_handler.__module__
+    summary = profile.setdefault(name, {}).setdefault(mod, Summary())
+    calls = 0
+
     def profiler(*args):
-        global profile
-        t0 = time.time()
+        nonlocal calls
+        calls += 1
+        sampled = calls >= profile_sample_interval
+        if sampled:
+            calls = 0
+        recorder = trace_recorder
+        timed = sampled or recorder is not None
+        if timed:
+            t0 = time.perf_counter_ns()
+        watchdog = stall_watchdog
+        if watchdog is not None:
+            prev_active = watchdog.enter(name, mod)
         try:
-            return event_handler(*args)
+            return schedule_if_coroutine(event_handler(*args), name, mod)
         except (Exception) as e:
-            # All this to include stack frames before the call to
-            # event_handler() above
-            tb = traceback.extract_stack()[:-1]
-            tb += traceback.extract_tb(e.__traceback__)
-            out = ["Traceback (most recent call last):\n"]
-            out += traceback.format_list(tb)
-            out += traceback.format_exception_only(type(e), e)
-            print("".join(out), end="")
+            exception_reporter.report(name, mod, e)
         finally:
-            elapsed = time.time() - t0
-            mod = event_handler.__module__
-            p = profile.setdefault(event_handler.__name__, {})
-            p.setdefault(mod, Summary()).record(elapsed)
-
-    # Make the method look like the original for introspection
-    profiler.__doc__ = event_handler.__doc__
-    profiler.__name__ = event_handler.__name__
-    profiler.__module__ = event_handler.__module__
-    # Follow the pattern of decorators like @classmethod and @staticmethod
-    profiler.__func__ = event_handler
-    return profiler
+            if watchdog is not None:
+                watchdog.exit(prev_active)
+            if timed:
+                elapsed = time.perf_counter_ns() - t0
+                if sampled:
+                    summary.record(elapsed / 1e9)
+                if recorder is not None:
+                    recorder.record(name, mod, t0, elapsed)
+
+    return _copy_handler_attributes(event_handler, profiler)
 
 
 def trap_exceptions(event_handler):
@@ -186,29 +436,380 @@ def trap_exceptions(event_handler):
         The decorated method
     """
 
-    def exception_handler(*args):
+    name = event_handler.__name__
+    mod = event_handler.__module__
+    plugin = plugin_module_for_name(mod)
+    stale_skippable = getattr(event_handler, 'skip_if_stale', False)
+
+    def call(args, dispatch=None):
+        if dispatch is not None:
+            prev_dispatch = getattr(dispatch_state, 'current', None)
+            dispatch_state.current = dispatch
+        if stale_skippable and not is_dispatch_current():
+            if dispatch is not None:
+                dispatch_state.current = prev_dispatch
+            return None
+        recorder = trace_recorder
+        if recorder is not None:
+            t0 = time.perf_counter_ns()
         try:
-            return event_handler(*args)
+            return schedule_if_coroutine(event_handler(*args), name, mod)
         except (Exception) as e:
-            # All this to include stack frames before the call to
-            # event_handler() above
-            tb = traceback.extract_stack()[:-1]
-            tb += traceback.extract_tb(e.__traceback__)
-            out = ["Traceback (most recent call last):\n"]
-            out += traceback.format_list(tb)
-            out += traceback.format_exception_only(type(e), e)
-            print("".join(out), end="")
+            exception_reporter.report(name, mod, e)
+        finally:
+            if recorder is not None:
+                recorder.record(name, mod, t0, time.perf_counter_ns() - t0)
+            if dispatch is not None:
+                dispatch_state.current = prev_dispatch
 
-    # Make the method look like the original for introspection
-    exception_handler.__doc__ = event_handler.__doc__
-    exception_handler.__name__ = event_handler.__name__
-    exception_handler.__module__ = event_handler.__module__
+    def exception_handler(*args):
+        executor = async_executor
+        if executor is not None:
+            # The handler will run on another thread, so take the dispatch
+            # state along with it
+            dispatch = getattr(dispatch_state, 'current', None)
+            executor.submit(
+                (plugin, dispatch_target(args)),
+                lambda args: call(args, dispatch),
+                args)
+            return None
+        return call(args)
+
+    _copy_handler_attributes(event_handler, exception_handler)
     event_handler.__name__ = '_wrapped_%s' % event_handler.__name__
-    # Follow the pattern of decorators like @classmethod and @staticmethod
-    exception_handler.__func__ = event_handler
     return exception_handler
 
 
+def skip_if_stale(event_handler):
+    """
+    Decorator for async view event handlers, so they are not run if the view
+    has been modified since the event was dispatched, e.g. while the handler
+    was queued behind other work
+
+    :param event_handler:
+        The event handler method
+
+    :return:
+        The event handler, marked to be skipped when stale
+    """
+
+    event_handler.skip_if_stale = True
+    return event_handler
+
+
+def dispatch_change_count():
+    """
+    :return:
+        The View.change_count() observed when the async view event being
+        handled on this thread was dispatched, or None outside of one
+    """
+
+    dispatch = getattr(dispatch_state, 'current', None)
+    if dispatch is None:
+        return None
+    return dispatch[1]
+
+
+def is_dispatch_current():
+    """
+    Checks if the view of the async event being handled on this thread has
+    not been modified since the event was dispatched, so that results
+    computed for it are still valid. Always True outside of an async view
+    event.
+
+    :return:
+        A bool
+    """
+
+    dispatch = getattr(dispatch_state, 'current', None)
+    if dispatch is None:
+        return True
+    view_id, change_count = dispatch
+    return sublime_api.view_change_count(view_id) == change_count
+
+
+def dispatch_target(args):
+    """
+    :param args:
+        The arguments an event handler method was called with, including self
+
+    :return:
+        A hashable identifying the view, buffer or window the event is for,
+        or None
+    """
+
+    for arg in args[:2]:
+        if isinstance(arg, sublime.View):
+            return ('view', arg.view_id)
+        if isinstance(arg, sublime.Buffer):
+            return ('buffer', arg.buffer_id)
+        if isinstance(arg, sublime.Window):
+            return ('window', arg.window_id)
+
+    # ViewEventListener and TextChangeListener handlers only receive self
+    if args:
+        view = getattr(args[0], 'view', None)
+        if isinstance(view, sublime.View):
+            return ('view', view.view_id)
+        buf = getattr(args[0], 'buffer', None)
+        if isinstance(buf, sublime.Buffer):
+            return ('buffer', buf.buffer_id)
+    return None
+
+
+class AsyncHandlerExecutor:
+    """
+    Runs async event handlers on a bounded pool of threads, so a slow plugin
+    doesn't hold up the async handlers of every other plugin. Handlers with
+    the same key, a (plugin module, view) pair, run one at a time in the order
+    they were submitted, and no plugin runs handlers on more than
+    max_per_plugin threads at once.
+    """
+
+    def __init__(self, max_workers=4, max_per_plugin=None):
+        """
+        :param max_workers:
+            The number of worker threads
+
+        :param max_per_plugin:
+            The number of threads one plugin's handlers may use at a time,
+            defaults to half of max_workers
+        """
+
+        self.max_workers = max_workers
+        if max_per_plugin is None:
+            max_per_plugin = max(1, max_workers // 2)
+        self.max_per_plugin = max_per_plugin
+        # key -> deque of (enqueued_ns, fn, args). A key is present while it
+        # has queued work or a handler of it is running.
+        self.queues = {}
+        # Keys with queued work and no handler running
+        self.ready = collections.deque()
+        # plugin -> number of queued handlers
+        self.depths = {}
+        # plugin -> Summary of the seconds handlers spent queued
+        self.waits = {}
+        # plugin -> number of handlers running
+        self.running = {}
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.threads = []
+
+    def start(self):
+        for i in range(self.max_workers):
+            t = threading.Thread(
+                target=self._work, name=f'AsyncHandlerExecutor-{i}', daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        """
+        Stops the workers once all queued handlers have run
+        """
+
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def submit(self, key, fn, args):
+        """
+        :param key:
+            A (plugin, target) tuple - handlers with an equal key are run in
+            order, one at a time
+
+        :param fn:
+            A callable to be passed args
+
+        :param args:
+            A tuple of the handler arguments
+        """
+
+        with self.cond:
+            queue = self.queues.get(key)
+            if queue is None:
+                queue = self.queues[key] = collections.deque()
+                self.ready.append(key)
+                self.cond.notify()
+            queue.append((time.perf_counter_ns(), fn, args))
+            self.depths[key[0]] = self.depths.get(key[0], 0) + 1
+
+    def _next_key(self):
+        # The first ready key whose plugin is below its thread limit, the
+        # condition must be held
+        for i, key in enumerate(self.ready):
+            if self.running.get(key[0], 0) < self.max_per_plugin:
+                del self.ready[i]
+                return key
+        return None
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while True:
+                    key = self._next_key()
+                    if key is not None:
+                        break
+                    if self.stopped and not self.ready:
+                        return
+                    self.cond.wait()
+                enqueued_ns, fn, args = self.queues[key].popleft()
+                self.depths[key[0]] -= 1
+                self.running[key[0]] = self.running.get(key[0], 0) + 1
+                self.waits.setdefault(key[0], Summary()).record(
+                    (time.perf_counter_ns() - enqueued_ns) / 1e9)
+
+            try:
+                fn(args)
+            except (Exception):
+                # Handlers are normally trapped, but keep the worker alive
+                traceback.print_exc()
+            finally:
+                # Release the plugin's slot even if something escaped fn,
+                # otherwise the plugin and this key would stall for good
+                with self.cond:
+                    self.running[key[0]] -= 1
+                    if self.queues[key]:
+                        self.ready.append(key)
+                    else:
+                        del self.queues[key]
+                    # Keys held back by the plugin's thread limit may now run
+                    self.cond.notify_all()
+
+    def stats(self):
+        """
+        :return:
+            A list of (plugin, queue_depth, count, max_wait, sum_wait) tuples,
+            with wait times in seconds
+        """
+
+        with self.cond:
+            # Plugins whose handlers are all still queued have no waits yet
+            plugins = dict.fromkeys(itertools.chain(self.waits, self.depths))
+            result = []
+            for plugin in plugins:
+                s = self.waits.get(plugin)
+                if s is None:
+                    result.append((plugin, self.depths[plugin], 0, 0.0, 0.0))
+                else:
+                    result.append((plugin, self.depths.get(plugin, 0), s.count, s.max, s.sum))
+            return result
+
+
+def start_async_executor(max_workers=4, max_per_plugin=None):
+    """
+    Starts dispatching async event handlers onto a thread pool
+
+    :param max_workers:
+        The number of worker threads
+
+    :param max_per_plugin:
+        The number of threads one plugin's handlers may use at a time,
+        defaults to half of max_workers
+
+    :return:
+        The running AsyncHandlerExecutor
+    """
+
+    global async_executor
+    stop_async_executor()
+    async_executor = AsyncHandlerExecutor(max_workers, max_per_plugin)
+    async_executor.start()
+    return async_executor
+
+
+def stop_async_executor():
+    """
+    Goes back to running async event handlers directly. Handlers already
+    queued on the thread pool still run.
+    """
+
+    global async_executor
+    if async_executor is not None:
+        async_executor.stop()
+        async_executor = None
+
+
+def coalesced(interval_ms):
+    """
+    Decorator for on_modified_async() and on_selection_modified_async()
+    handlers of an EventListener or ViewEventListener. Events for the same
+    listener and view are collapsed into the latest one, which is only run
+    once no further events have arrived for interval_ms milliseconds.
+
+    :param interval_ms:
+        An int of the number of milliseconds the view must be idle for
+
+    :return:
+        A decorator marking the handler as coalesced
+    """
+
+    def decorator(event_handler):
+        event_handler.coalesce_interval_ms = interval_ms
+        return event_handler
+
+    return decorator
+
+
+def coalesce_events(event_handler, interval_ms):
+    """
+    Wraps an async event handler so that a burst of calls for the same
+    listener and view results in a single call with the latest arguments,
+    made once the burst has been idle for interval_ms
+
+    :param event_handler:
+        The event handler method - must be an unbound method
+
+    :param interval_ms:
+        An int of the number of milliseconds to wait for further events
+
+    :return:
+        The decorated method
+    """
+
+    # (listener, view_id) -> (deadline, args, dispatch) of the latest queued
+    # event
+    pending = {}
+    lock = threading.Lock()
+    interval = interval_ms / 1000
+
+    def fire(key):
+        with lock:
+            deadline, args, dispatch = pending[key]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                del pending[key]
+        if remaining > 0:
+            sublime.set_timeout_async(lambda: fire(key), int(remaining * 1000) + 1)
+            return
+        prev_dispatch = getattr(dispatch_state, 'current', None)
+        dispatch_state.current = dispatch
+        try:
+            event_handler(*args)
+        finally:
+            dispatch_state.current = prev_dispatch
+
+    def coalescer(*args):
+        # EventListener handlers receive the view as an argument, while
+        # ViewEventListener handlers have it as an attribute
+        if isinstance(args[0], sublime.View):
+            key = (None, args[0].view_id)
+        elif len(args) > 1 and isinstance(args[1], sublime.View):
+            key = (args[0], args[1].view_id)
+        else:
+            key = (args[0], args[0].view.view_id)
+
+        with lock:
+            scheduled = key in pending
+            pending[key] = (
+                time.monotonic() + interval,
+                args,
+                getattr(dispatch_state, 'current', None))
+        if not scheduled:
+            sublime.set_timeout_async(lambda: fire(key), interval_ms)
+
+    return _copy_handler_attributes(event_handler, coalescer)
+
+
 def decorate_handler(cls, method_name):
     """
     Decorates an event handler method with exception trapping, and in the case
@@ -224,11 +825,47 @@ def decorate_handler(cls, method_name):
     # We have to use __dict__ rather than getattr(), otherwise the function
     # is passed through decorators, and we can't detect @classmethod and
     # @staticmethod
-    method = cls.__dict__[method_name]
+    if method_name in cls.__dict__:
+        method = cls.__dict__[method_name]
+    else:
+        # Inherited from a base class, such as TextBufferMirror. Methods of
+        # base classes that were loaded as plugins are already decorated, and
+        # so are wrappers with the original method as their __func__.
+        for base in cls.__mro__[1:]:
+            if method_name in base.__dict__:
+                method = base.__dict__[method_name]
+                break
+        if isinstance(method, (staticmethod, classmethod)):
+            func = method.__func__
+        else:
+            func = method
+        if hasattr(func, '__func__'):
+            return
     if method_name.endswith('_async'):
         wrapper = trap_exceptions
     else:
         wrapper = add_profiling
+
+    func = getattr(method, '__func__', method)
+    interval_ms = getattr(func, 'coalesce_interval_ms', None)
+    if method_name in coalescable_callbacks and interval_ms is not None:
+        def wrapper(event_handler):
+            return coalesce_events(trap_exceptions(event_handler), interval_ms)
+
+    # Changes are merged and converted inside the trapped call, so that
+    # exceptions from doing so are reported like those of the handler
+    if method_name == 'on_text_changed_async' and getattr(cls, 'coalesce_changes', False):
+        decorate_coalesced = wrapper
+
+        def wrapper(event_handler):
+            return decorate_coalesced(deliver_coalesced(event_handler))
+
+    if method_name in columnar_callbacks and getattr(cls, 'columnar_changes', False):
+        decorate_columnar = wrapper
+
+        def wrapper(event_handler):
+            return decorate_columnar(deliver_columnar(event_handler))
+
     if isinstance(method, staticmethod):
         wrapped = staticmethod(wrapper(method.__func__))
     elif isinstance(method, classmethod):
@@ -248,9 +885,13 @@ def unload_module(module):
     # Unload the old plugins
     if "__plugins__" in module.__dict__:
         for view_id, listener_instances in view_event_listeners.items():
-            for vel in listener_instances[:]:
-                if vel.__class__ in module.__plugins__:
-                    listener_instances.remove(vel)
+            removed = False
+            for cls in list(listener_instances):
+                if cls in module.__plugins__:
+                    del listener_instances[cls]
+                    removed = True
+            if removed:
+                rebuild_view_event_listener_handlers(view_id)
 
         for buffer_id, listener_instances in text_change_listeners.items():
             for tcl in listener_instances[:]:
@@ -264,11 +905,13 @@ def unload_module(module):
                     cmd_cls_list.remove(p)
                 except ValueError:
                     pass
-            for c in all_callbacks.values():
+            for name, c in all_callbacks.items():
                 try:
                     c.remove(p)
                 except ValueError:
                     pass
+                else:
+                    rebuild_el_dispatch_table(name)
 
             try:
                 view_event_listener_classes.remove(p)
@@ -368,6 +1011,7 @@ def load_module(m):
                     for method_name, listeners in all_callbacks.items():
                         if method_name in dir(t):
                             listeners.append(obj)
+                            rebuild_el_dispatch_table(method_name)
 
                     if "on_activated" in dir(obj):
                         on_activated_targets.append(obj)
@@ -391,10 +1035,15 @@ def load_module(m):
                         vel_on_activated_async_targets.append(t)
                     module_plugins.append(t)
 
-                if issubclass(t, TextChangeListener) and t is not TextChangeListener:
+                # The listeners provided by this module are only bases for
+                # plugins, even when imported into a plugin's namespace
+                if (issubclass(t, TextChangeListener)
+                        and t not in (TextChangeListener, TextBufferMirror, TextLineIndex, TextColumnIndex)):
                     for name in text_change_listener_callbacks:
                         if name in dir(t):
                             decorate_handler(t, name)
+                    if t.coalesce_changes and "on_text_changed_async" in dir(t):
+                        queue_text_changes(t)
 
                     module_plugins.append(t)
                     text_change_listener_classes.append(t)
@@ -587,35 +1236,94 @@ def is_view_event_listener_applicable(cls, view):
 def create_view_event_listeners(classes, view):
     if len(classes) > 0:
         if view.view_id not in view_event_listeners:
-            view_event_listeners[view.view_id] = []
+            view_event_listeners[view.view_id] = {}
+
+        listeners = view_event_listeners[view.view_id]
 
         for c in classes:
-            if is_view_event_listener_applicable(c, view):
-                view_event_listeners[view.view_id].append(c(view))
+            if c not in listeners and is_view_event_listener_applicable(c, view):
+                listeners[c] = c(view)
 
+        rebuild_view_event_listener_handlers(view.view_id)
 
-def check_view_event_listeners(view):
-    if len(view_event_listener_classes) > 0:
+
+def check_view_event_listeners(view, classes=None):
+    if classes is None:
+        classes = view_event_listener_classes
+
+    if len(classes) > 0:
         if view.view_id not in view_event_listeners:
-            view_event_listeners[view.view_id] = []
+            view_event_listeners[view.view_id] = {}
 
         listeners = view_event_listeners[view.view_id]
+        changed = False
 
-        for cls in view_event_listener_classes:
-            found = False
-            instance = None
-            for l in listeners:
-                if l.__class__ == cls:
-                    found = True
-                    instance = l
-                    break
+        for cls in classes:
+            found = cls in listeners
 
             want = is_view_event_listener_applicable(cls, view)
 
             if want and not found:
-                listeners.append(cls(view))
+                listeners[cls] = cls(view)
+                changed = True
             elif found and not want:
-                listeners.remove(instance)
+                del listeners[cls]
+                changed = True
+
+        if changed:
+            rebuild_view_event_listener_handlers(view.view_id)
+
+
+def rebuild_view_event_listener_handlers(view_id):
+    handlers = {}
+    for vel in view_event_listeners.get(view_id, {}).values():
+        for name in all_callbacks:
+            if name in view_event_listener_excluded_callbacks:
+                continue
+            method = getattr(vel, name, None)
+            if method is not None:
+                handlers.setdefault(name, []).append(method)
+
+    view_event_listener_handlers[view_id] = {
+        name: tuple(methods) for name, methods in handlers.items()
+    }
+
+
+def snapshot_view_settings(view):
+    keys = set()
+    for cls in view_event_listener_classes:
+        cls_keys = cls.applicable_settings_keys()
+        if cls_keys is not None:
+            keys.update(cls_keys)
+
+    settings = view.settings()
+    return {key: settings.get(key) for key in keys}
+
+
+def on_view_settings_changed(view):
+    """
+    Re-evaluates the applicability of the ViewEventListener classes of a view
+    after its settings changed. Classes that declare the settings keys they
+    depend on are skipped unless one of those keys changed value.
+
+    :param view:
+        The sublime.View object whose settings changed
+    """
+
+    old = view_settings_snapshots.get(view.view_id, {})
+    new = snapshot_view_settings(view)
+    view_settings_snapshots[view.view_id] = new
+
+    changed = {key for key, value in new.items() if key not in old or old[key] != value}
+
+    classes = []
+    for cls in view_event_listener_classes:
+        cls_keys = cls.applicable_settings_keys()
+        if cls_keys is None or not changed.isdisjoint(cls_keys):
+            classes.append(cls)
+
+    if classes:
+        check_view_event_listeners(view, classes)
 
 
 def attach_view(view):
@@ -623,12 +1331,17 @@ def attach_view(view):
         view = sublime.View(view)
 
     check_view_event_listeners(view)
+    view_settings_snapshots[view.view_id] = snapshot_view_settings(view)
 
     view.settings().add_on_change(
         "check_view_event_listeners",
-        lambda: check_view_event_listeners(view))
+        lambda: on_view_settings_changed(view))
 
 
+# When True, closing a view re-checks every view in every window rather than
+# only the remaining views into the closed view's buffer
+check_all_views_on_detach = False
+
 check_all_view_event_listeners_scheduled = False
 
 
@@ -640,25 +1353,50 @@ def check_all_view_event_listeners():
             check_view_event_listeners(v)
 
 
+pending_detached_buffer_ids = set()
+check_detached_buffer_views_scheduled = False
+
+
+def check_detached_buffer_views():
+    global check_detached_buffer_views_scheduled
+    check_detached_buffer_views_scheduled = False
+    buffer_ids = list(pending_detached_buffer_ids)
+    pending_detached_buffer_ids.clear()
+    for buffer_id in buffer_ids:
+        for v in sublime.Buffer(buffer_id).views():
+            check_view_event_listeners(v)
+
+
 def detach_view(view):
     if view.view_id in view_event_listeners:
         del view_event_listeners[view.view_id]
+    view_event_listener_handlers.pop(view.view_id, None)
+    view_settings_snapshots.pop(view.view_id, None)
+    completion_refinement_cache.pop(view.view_id, None)
 
     # A view has closed, which implies 'is_primary' may have changed, so see if
     # any of the ViewEventListener classes need to be created.
     # Call this in a timeout, as 'view' will still be reporting itself as a
-    # primary at this stage
-    global check_all_view_event_listeners_scheduled
-    if not check_all_view_event_listeners_scheduled:
-        check_all_view_event_listeners_scheduled = True
-        sublime.set_timeout(check_all_view_event_listeners)
+    # primary at this stage. Only the other views into the same buffer can
+    # have changed, so unless a full sweep was requested just check those.
+    buffer_id = view.buffer_id()
+    if check_all_views_on_detach or not buffer_id:
+        global check_all_view_event_listeners_scheduled
+        if not check_all_view_event_listeners_scheduled:
+            check_all_view_event_listeners_scheduled = True
+            sublime.set_timeout(check_all_view_event_listeners)
+        return
+
+    global check_detached_buffer_views_scheduled
+    pending_detached_buffer_ids.add(buffer_id)
+    if not check_detached_buffer_views_scheduled:
+        check_detached_buffer_views_scheduled = True
+        sublime.set_timeout(check_detached_buffer_views)
 
 
 def find_view_event_listener(view, cls):
     if view.view_id in view_event_listeners:
-        for vel in view_event_listeners[view.view_id]:
-            if vel.__class__ == cls:
-                return vel
+        return view_event_listeners[view.view_id].get(cls)
     return None
 
 
@@ -701,46 +1439,84 @@ def detach_buffer(buf):
 
 
 def plugin_module_for_obj(obj):
+    return plugin_module_for_name(obj.__class__.__module__)
+
+
+def plugin_module_for_name(cm):
     # Since objects in plugins may be defined deep in a sub-module, if we want
     # to filter by a module, we must make sure we are only looking at the
     # first two module labels
-    cm = obj.__class__.__module__
     if cm.count('.') > 2:
         cm = '.'.join(cm.split('.', 2)[0:2])
     return cm
 
 
+def rebuild_el_dispatch_table(name):
+    el_dispatch_tables[name] = tuple(getattr(el, name) for el in all_callbacks[name])
+
+
 def el_callbacks(name, listener_only=False):
-    for el in all_callbacks[name]:
-        yield el if listener_only else getattr(el, name)
+    if listener_only:
+        yield from all_callbacks[name]
+    else:
+        yield from el_dispatch_tables[name]
 
 
 def vel_callbacks(v, name, listener_only=False):
-    for vel in view_event_listeners.get(v.view_id, []):
-        if not hasattr(vel, name):
-            continue
-        yield vel if listener_only else getattr(vel, name)
+    if not listener_only:
+        yield from view_event_listener_handlers.get(v.view_id, {}).get(name, ())
+        return
+
+    for vel in view_event_listeners.get(v.view_id, {}).values():
+        if hasattr(vel, name):
+            yield vel
 
 
 def run_view_callbacks(name, view_id, *args, el_only=False):
+    recorder = trace_recorder
+    if recorder is not None:
+        t0 = time.perf_counter_ns()
+
     v = sublime.View(view_id)
 
-    for callback in el_callbacks(name):
-        callback(v, *args)
+    el_handlers = el_dispatch_tables[name]
+    vel_handlers = ()
+    if not el_only:
+        vel_handlers = view_event_listener_handlers.get(view_id, {}).get(name, ())
 
-    if el_only:
-        return
+    # Remember what state of the view async handlers were dispatched for, so
+    # they can tell if their work has become stale
+    is_async = name.endswith('_async') and (el_handlers or vel_handlers)
+    if is_async:
+        prev_dispatch = getattr(dispatch_state, 'current', None)
+        dispatch_state.current = (view_id, sublime_api.view_change_count(view_id))
+
+    for callback in el_handlers:
+        callback(v, *args)
 
-    for callback in vel_callbacks(v, name):
+    for callback in vel_handlers:
         callback(*args)
 
+    if is_async:
+        dispatch_state.current = prev_dispatch
+
+    if recorder is not None:
+        recorder.record(name, __name__, t0, time.perf_counter_ns() - t0)
+
 
 def run_window_callbacks(name, window_id, *args):
+    recorder = trace_recorder
+    if recorder is not None:
+        t0 = time.perf_counter_ns()
+
     w = sublime.Window(window_id)
 
-    for callback in el_callbacks(name):
+    for callback in el_dispatch_tables[name]:
         callback(w, *args)
 
+    if recorder is not None:
+        recorder.record(name, __name__, t0, time.perf_counter_ns() - t0)
+
 
 def on_init(module):
     """
@@ -854,28 +1630,404 @@ def on_clone_async(view_id):
 
 
 class Summary:
+    """
+    Latency statistics for an event handler. Besides the count, sum and max,
+    durations are recorded in a fixed size histogram: each power of two is
+    split into SUB_BUCKETS linear buckets, so percentiles are accurate to
+    within roughly 6%.
+    """
+
+    SUB_BUCKETS = 16
+    # math.frexp() gives 2**(exponent - 1) <= x < 2**exponent, so buckets
+    # for exponents MIN_EXPONENT to MAX_EXPONENT - 1 cover 2**-21 (~0.5us) up
+    # to 2**8 (256s) seconds. Durations outside that are clamped to the first
+    # or last bucket.
+    MIN_EXPONENT = -20
+    MAX_EXPONENT = 9
+
     def __init__(self):
         self.max = 0.0
         self.sum = 0.0
         self.count = 0
+        self.buckets = [0] * ((self.MAX_EXPONENT - self.MIN_EXPONENT) * self.SUB_BUCKETS)
 
     def record(self, x):
         self.count += 1
         self.sum += x
         self.max = max(self.max, x)
 
+        idx = 0
+        if x > 0:
+            mantissa, exponent = math.frexp(x)
+            idx = ((exponent - self.MIN_EXPONENT) * self.SUB_BUCKETS
+                   + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS))
+            idx = min(max(idx, 0), len(self.buckets) - 1)
+        self.buckets[idx] += 1
+
+    def percentile(self, q):
+        """
+        :param q:
+            A float between 0 and 1, e.g. 0.99 for the 99th percentile
+
+        :return:
+            A float of the upper bound of the bucket containing the
+            percentile, in seconds
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                exponent = idx // self.SUB_BUCKETS + self.MIN_EXPONENT
+                mantissa = 0.5 + (idx % self.SUB_BUCKETS + 1) / (2 * self.SUB_BUCKETS)
+                return min(math.ldexp(mantissa, exponent), self.max)
+        return self.max
+
+    def reset(self):
+        self.max = 0.0
+        self.sum = 0.0
+        self.count = 0
+        self.buckets = [0] * len(self.buckets)
+
+
+profiling_percentiles = (0.5, 0.9, 0.99, 0.999)
+
+
+def get_profiling_data(percentiles=False):
+    """
+    :param percentiles:
+        If True, each entry has an extra element of a tuple of the p50, p90,
+        p99 and p999 latencies
+
+    :return:
+        A list of (event, plugin, count, max, sum) tuples. When
+        profile_sample_interval is greater than 1, only sampled calls are
+        counted.
+    """
 
-def get_profiling_data():
     global profile
     out = []
     for event in profile:
         data = profile[event]
         for plugin in data:
             s = data[plugin]
-            out.append((event, plugin, s.count, s.max, s.sum))
+            if s.count == 0:
+                continue
+            if percentiles:
+                out.append((
+                    event, plugin, s.count, s.max, s.sum,
+                    tuple(s.percentile(q) for q in profiling_percentiles)
+                ))
+            else:
+                out.append((event, plugin, s.count, s.max, s.sum))
     return out
 
 
+class TraceRecorder:
+    """
+    A bounded ring buffer of event handler timings, for seeing which handlers
+    ran in which order. Once full, the oldest entries are discarded, so it is
+    safe to leave running.
+    """
+
+    def __init__(self, capacity=100000):
+        """
+        :param capacity:
+            The maximum number of entries to keep
+        """
+
+        self.entries = collections.deque(maxlen=capacity)
+
+    def record(self, event, module, start_ns, duration_ns):
+        self.entries.append(
+            (event, module, threading.get_ident(), start_ns, duration_ns))
+
+    def clear(self):
+        self.entries.clear()
+
+    def _thread_names(self):
+        return {t.ident: t.name for t in threading.enumerate()}
+
+    def to_chrome_trace(self):
+        """
+        :return:
+            A dict in the Chrome Trace Event format, to be serialized as JSON
+            and loaded into chrome://tracing or Perfetto
+        """
+
+        pid = os.getpid()
+        thread_names = self._thread_names()
+        events = []
+        tids = set()
+        for event, module, tid, start_ns, duration_ns in list(self.entries):
+            tids.add(tid)
+            events.append({
+                "name": event,
+                "cat": module,
+                "ph": "X",
+                "ts": start_ns / 1000,
+                "dur": duration_ns / 1000,
+                "pid": pid,
+                "tid": tid,
+            })
+        for tid in tids:
+            events.append({
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": thread_names.get(tid, str(tid))},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_speedscope(self):
+        """
+        :return:
+            A dict in the speedscope file format, with one evented profile
+            per thread, to be serialized as JSON
+        """
+
+        thread_names = self._thread_names()
+        frames = []
+        frame_indexes = {}
+        by_thread = {}
+        for event, module, tid, start_ns, duration_ns in list(self.entries):
+            key = (event, module)
+            if key not in frame_indexes:
+                frame_indexes[key] = len(frames)
+                frames.append({"name": event, "file": module})
+            by_thread.setdefault(tid, []).append(
+                (start_ns, start_ns + duration_ns, frame_indexes[key]))
+
+        profiles = []
+        for tid, spans in by_thread.items():
+            # Outer spans sort before the spans nested inside them
+            spans.sort(key=lambda s: (s[0], -s[1]))
+            events = []
+            stack = []
+            for start, end, frame in spans:
+                while stack and stack[-1][0] <= start:
+                    close_at, close_frame = stack.pop()
+                    events.append({"type": "C", "frame": close_frame, "at": close_at})
+                if stack:
+                    end = min(end, stack[-1][0])
+                events.append({"type": "O", "frame": frame, "at": start})
+                stack.append((end, frame))
+            while stack:
+                close_at, close_frame = stack.pop()
+                events.append({"type": "C", "frame": close_frame, "at": close_at})
+
+            profiles.append({
+                "type": "evented",
+                "name": thread_names.get(tid, str(tid)),
+                "unit": "nanoseconds",
+                "startValue": events[0]["at"],
+                "endValue": events[-1]["at"],
+                "events": events,
+            })
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+def start_tracing(capacity=100000):
+    """
+    Starts recording the timings of all decorated event handlers, and of
+    run_view_callbacks() and run_window_callbacks()
+
+    :param capacity:
+        The maximum number of entries to keep
+
+    :return:
+        The active TraceRecorder
+    """
+
+    global trace_recorder
+    trace_recorder = TraceRecorder(capacity)
+    return trace_recorder
+
+
+def stop_tracing():
+    """
+    :return:
+        The TraceRecorder that was active, or None
+    """
+
+    global trace_recorder
+    recorder = trace_recorder
+    trace_recorder = None
+    return recorder
+
+
+class StallWatchdog:
+    """
+    Reports blocking event handlers and set_timeout() callbacks that run for
+    longer than a threshold, along with the stacks of all threads at that
+    point. The watched code only records when it started; all of the checking
+    is done on a separate thread.
+    """
+
+    def __init__(self, threshold=1.0, max_reports=20):
+        """
+        :param threshold:
+            The number of seconds a callback may block for before it is
+            reported
+
+        :param max_reports:
+            The number of most recent reports to keep in self.reports
+        """
+
+        self.threshold_ns = int(threshold * 1e9)
+        # Maps each thread id to a (start_ns, name, module, thread_id) tuple
+        # of the innermost callback currently running on that thread. Kept
+        # per thread as handlers such as parallel completion providers run
+        # off the main thread at the same time as main thread callbacks.
+        self.active = {}
+        self.reports = collections.deque(maxlen=max_reports)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='StallWatchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def enter(self, name, mod):
+        """
+        Marks a callback as running on the current thread
+
+        :param name:
+            A unicode string of the name of the callback
+
+        :param mod:
+            A unicode string of the module the callback is defined in
+
+        :return:
+            The previously running callback on this thread, to pass to exit()
+        """
+
+        tid = threading.get_ident()
+        prev_active = self.active.get(tid)
+        self.active[tid] = (time.perf_counter_ns(), name, mod, tid)
+        return prev_active
+
+    def exit(self, prev_active):
+        """
+        Marks the callback started by the matching enter() as finished
+
+        :param prev_active:
+            The value returned by enter()
+        """
+
+        if prev_active is None:
+            self.active.pop(threading.get_ident(), None)
+        else:
+            self.active[prev_active[3]] = prev_active
+
+    def wrap(self, f):
+        """
+        :param f:
+            A callable taking no arguments, e.g. a set_timeout() callback
+
+        :return:
+            A callable that marks f as running while it is called
+        """
+
+        name = getattr(f, '__qualname__', repr(f))
+        mod = getattr(f, '__module__', None) or '<unknown>'
+
+        def watched():
+            prev_active = self.enter(name, mod)
+            try:
+                return f()
+            finally:
+                self.exit(prev_active)
+
+        return watched
+
+    def _run(self):
+        reported = {}
+        interval = self.threshold_ns / 4e9
+        while not self._stopped.wait(interval):
+            for active in list(self.active.values()):
+                if reported.get(active[3]) is active:
+                    continue
+                elapsed = time.perf_counter_ns() - active[0]
+                if elapsed >= self.threshold_ns:
+                    reported[active[3]] = active
+                    self.report(active, elapsed)
+
+    def report(self, active, elapsed_ns):
+        _, name, mod, tid = active
+        frames = sys._current_frames()
+        thread_names = {t.ident: t.name for t in threading.enumerate()}
+
+        out = [
+            f"{mod}.{name} has blocked {thread_names.get(tid, tid)} "
+            f"for {elapsed_ns / 1e9:.3f}s\n"
+        ]
+        # The blocked thread first, since it shows the culprit
+        for ident in sorted(frames, key=lambda i: i != tid):
+            if ident == threading.get_ident():
+                continue
+            out.append(f"\nThread {thread_names.get(ident, ident)} "
+                       "(most recent call last):\n")
+            out += traceback.format_stack(frames[ident])
+
+        text = "".join(out)
+        self.reports.append(text)
+        print(text, end="")
+
+
+def start_stall_watchdog(threshold=1.0):
+    """
+    Starts reporting blocking event handlers and set_timeout() callbacks that
+    run for longer than threshold seconds
+
+    :param threshold:
+        A float of the number of seconds
+
+    :return:
+        The running StallWatchdog
+    """
+
+    global stall_watchdog
+    stop_stall_watchdog()
+    stall_watchdog = StallWatchdog(threshold)
+    stall_watchdog.start()
+    sublime._main_thread_watchdog = stall_watchdog
+    return stall_watchdog
+
+
+def stop_stall_watchdog():
+    global stall_watchdog
+    if stall_watchdog is not None:
+        stall_watchdog.stop()
+        stall_watchdog = None
+    sublime._main_thread_watchdog = None
+
+
+def reset_profiling_data():
+    """
+    Clears the recorded statistics of all event handlers, so that the next
+    call to get_profiling_data() only covers the time since this call
+    """
+
+    for data in profile.values():
+        for s in data.values():
+            s.reset()
+
+
 def on_load(view_id):
     run_view_callbacks('on_load', view_id)
 
@@ -973,77 +2125,367 @@ def on_deactivated_async(view_id):
     run_view_callbacks('on_deactivated_async', view_id)
 
 
-def on_query_context(view_id, key, operator, operand, match_all):
-    v = sublime.View(view_id)
-    for callback in el_callbacks('on_query_context'):
-        val = callback(v, key, operator, operand, match_all)
-        if val:
-            return True
-    for callback in vel_callbacks(v, 'on_query_context'):
-        val = callback(key, operator, operand, match_all)
-        if val:
-            return True
-    return False
+def on_query_context(view_id, key, operator, operand, match_all):
+    v = sublime.View(view_id)
+    for callback in el_callbacks('on_query_context'):
+        val = callback(v, key, operator, operand, match_all)
+        if val:
+            return True
+    for callback in vel_callbacks(v, 'on_query_context'):
+        val = callback(key, operator, operand, match_all)
+        if val:
+            return True
+    return False
+
+
+# Maps completion kinds to their normalised (kind, letter, name) form
+completion_kind_cache = {}
+
+
+def normalise_completion_kind(kind):
+    try:
+        return completion_kind_cache[kind]
+    except (KeyError, TypeError):
+        pass
+
+    kind_id, kind_letter, kind_name = kind
+
+    letter = 0
+    if isinstance(kind_letter, str) and kind_letter != '':
+        letter = ord(kind_letter)
+    result = (kind_id, letter, kind_name)
+
+    if isinstance(kind, tuple) and len(completion_kind_cache) < 1024:
+        completion_kind_cache[kind] = result
+    return result
+
+
+def normalise_completion_item(c):
+    # Providers often hand back the same CompletionItem objects for every
+    # request, so the normalised form is kept on the item for as long as
+    # none of its attributes are reassigned
+    cached = c._normalised
+    if cached is not None:
+        kind, n = cached
+        if (kind is c.kind
+                and n[0] is c.trigger
+                and n[1] is c.annotation
+                and n[2] is c.details
+                and n[3] is c.completion
+                and n[6] is c.completion_format
+                and n[7] is c.flags):
+            return n
+
+    kind = c.kind
+    kind_id, letter, kind_name = normalise_completion_kind(kind)
+    n = (c.trigger, c.annotation, c.details, c.completion, kind_name, letter, c.completion_format, c.flags, kind_id)
+    if isinstance(kind, tuple):
+        c._normalised = (kind, n)
+    return n
+
+
+def normalise_completion_sequence(c):
+    kind_id, letter, kind_name = normalise_completion_kind(sublime.KIND_AMBIGUOUS)
+
+    n = len(c)
+    if n == 1:
+        trigger, _, annotation = c[0].partition("\t")
+        return (trigger, annotation, "", "", kind_name, letter, sublime.COMPLETION_FORMAT_TEXT, 0, kind_id)
+    elif n == 2 or n == 3:
+        trigger, _, annotation = c[0].partition("\t")
+        return (trigger, annotation, "", c[n - 1], kind_name, letter, sublime.COMPLETION_FORMAT_SNIPPET, 0, kind_id)
+    else:
+        return ("", "", "", "", kind_name, letter, sublime.COMPLETION_FORMAT_TEXT, 0, kind_id)
+
+
+def normalise_completion(c):
+    if isinstance(c, sublime.CompletionItem):
+        return normalise_completion_item(c)
+
+    if isinstance(c, str):
+        kind_id, letter, kind_name = normalise_completion_kind(sublime.KIND_AMBIGUOUS)
+        trigger, _, annotation = c.partition("\t")
+        return (trigger, annotation, "", "", kind_name, letter, sublime.COMPLETION_FORMAT_TEXT, 0, kind_id)
+
+    return normalise_completion_sequence(c)
+
+
+def normalise_completions(completions):
+    """
+    Normalises a whole list of completions at once, taking a fast path when
+    all of them are of the same type, as is the case for most providers
+
+    :param completions:
+        An iterable of CompletionItem objects, strs and sequences of strs
+
+    :return:
+        A list of normalised completion tuples
+    """
+
+    if not isinstance(completions, list):
+        completions = list(completions)
+    if not completions:
+        return []
+
+    types = set(map(type, completions))
+    if len(types) == 1:
+        t = types.pop()
+
+        if t is str:
+            kind_id, letter, kind_name = normalise_completion_kind(sublime.KIND_AMBIGUOUS)
+            text = sublime.COMPLETION_FORMAT_TEXT
+            result = []
+            append = result.append
+            for c in completions:
+                trigger, _, annotation = c.partition("\t")
+                append((trigger, annotation, "", "", kind_name, letter, text, 0, kind_id))
+            return result
+
+        if t is sublime.CompletionItem:
+            return list(map(normalise_completion_item, completions))
+
+        if t is tuple or t is list:
+            return list(map(normalise_completion_sequence, completions))
+
+    return list(map(normalise_completion, completions))
+
+
+# When True, a completion request is answered after at most
+# completion_request_deadline_ms with the lists that are ready by then,
+# rather than waiting for every list. The host only accepts one set of
+# completions per request, so lists set later are dropped; a partial answer
+# is flagged with DYNAMIC_COMPLETIONS so the host re-queries as the user
+# types, giving the slow providers another chance.
+deadline_completions = False
+
+# The number of milliseconds after which a completion request is answered
+# when deadline_completions is set, even if some lists have not been set
+completion_request_deadline_ms = 1000
+
+
+class MultiCompletionList:
+    def __init__(self, num_completion_lists, view_id, req_id):
+        self.remaining_calls = num_completion_lists
+        self.view_id = view_id
+        self.req_id = req_id
+        self.completions = []
+        self.flags = 0
+        self.finalised = False
+        self.lock = threading.Lock()
+
+    def completions_ready(self, completions, flags):
+        self.normalised_completions_ready(normalise_completions(completions), flags)
+
+    def normalised_completions_ready(self, normalised, flags):
+        with self.lock:
+            if self.finalised:
+                return
+            self.completions += normalised
+            self.flags |= flags
+            self.remaining_calls -= 1
+            if self.remaining_calls != 0:
+                return
+            self.finalised = True
+
+        sublime_api.view_set_completions(
+            self.view_id, self.req_id, (self.completions, self.flags))
+
+    def finalise_after(self, timeout_ms):
+        """
+        Answers the request with the completions that are available after
+        timeout_ms, if some lists have still not been set by then
+
+        :param timeout_ms:
+            An int of the number of milliseconds
+        """
+
+        sublime.set_timeout_async(self.finalise, timeout_ms)
+
+    def finalise(self):
+        with self.lock:
+            if self.finalised:
+                return
+            self.finalised = True
+            # Lists are missing, so have the completions re-queried as the
+            # user types rather than treating this answer as complete
+            flags = self.flags | sublime.DYNAMIC_COMPLETIONS
+
+        sublime_api.view_set_completions(
+            self.view_id, self.req_id, (self.completions, flags))
+
+
+# The number of milliseconds on_query_completions() providers decorated with
+# parallel_completions have to respond before their results are dropped
+completion_deadline_ms = 200
+
+completion_executor = None
+completion_executor_lock = threading.Lock()
+
+
+def parallel_completions(event_handler):
+    """
+    Decorator for on_query_completions() methods that are safe to be run on a
+    worker thread. Such providers run concurrently with each other and with
+    the remaining providers, and whatever they haven't returned within
+    completion_deadline_ms is dropped.
+
+    :param event_handler:
+        The on_query_completions() method
+
+    :return:
+        The method, marked to be run in parallel
+    """
+
+    event_handler.parallel_completions = True
+    return event_handler
+
+
+def get_completion_executor():
+    global completion_executor
+    with completion_executor_lock:
+        if completion_executor is None:
+            completion_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=4, thread_name_prefix='Completions')
+    return completion_executor
+
+
+class DeadlineCompletionList:
+    """
+    Receives the result of an on_query_completions() provider run on a worker
+    thread, and passes it to self.completion_list unless the deadline passes
+    first, in which case an empty list is passed instead.
+
+    The list is only ever set on the main thread, where on_query_completions()
+    sets its target, as CompletionList doesn't guard against the two
+    happening at once. The deadline is timed on the main thread too, as the
+    async thread may be held up by the very handlers it is meant to cut off.
+    """
+
+    def __init__(self, deadline_ms):
+        self.completion_list = sublime.CompletionList()
+        self.finished = False
+        # Whether the deadline passed before the provider produced a result
+        self.expired = False
+        self.lock = threading.Lock()
+        sublime.set_timeout(self.expire, deadline_ms)
+
+    def completions_ready(self, completions, flags, expired=False):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+            self.expired = expired
+        sublime.set_timeout(lambda: self.completion_list.set_completions(completions, flags))
+
+    def expire(self):
+        self.completions_ready([], 0, expired=True)
+
+    def provider_done(self, future):
+        res = future.result()
+        if isinstance(res, tuple):
+            self.completions_ready(res[0], res[1])
+        elif isinstance(res, list):
+            self.completions_ready(res, 0)
+        elif isinstance(res, sublime.CompletionList):
+            res._set_target(self)
+        else:
+            self.completions_ready([], 0)
+
+
+# Maps view ids to the (context, prefix, change count, results) of the last
+# completion query in the view, where results maps each prefix_refinable
+# provider to the (normalised completions, flags) it produced
+completion_refinement_cache = {}
+
+
+def prefix_refinable(event_handler):
+    """
+    Decorator for on_query_completions() methods whose completions for a
+    prefix are always a subset of those for any shorter prefix at the same
+    location. While the user keeps typing the same word, the previous
+    completions are filtered and reused instead of calling the method again.
+
+    :param event_handler:
+        The on_query_completions() method
+
+    :return:
+        The method, marked as prefix refinable
+    """
+
+    event_handler.prefix_refinable = True
+    return event_handler
+
+
+def refine_completions(completions, prefix):
+    """
+    Keeps the normalised completions whose trigger contains the characters of
+    prefix in order, ignoring case, as the completion popup would
+
+    :param completions:
+        A list of normalised completion tuples
+
+    :param prefix:
+        The str the user has typed
+
+    :return:
+        A list of the matching completion tuples
+    """
+
+    if not prefix:
+        return completions
+
+    needle = prefix.lower()
+    result = []
+    for c in completions:
+        trigger = c[0].lower()
+        if trigger.startswith(needle):
+            result.append(c)
+            continue
+        i = 0
+        for ch in needle:
+            i = trigger.find(ch, i) + 1
+            if i == 0:
+                break
+        else:
+            result.append(c)
+    return result
+
 
+class CachedCompletionList:
+    """
+    Stands in for the CompletionList of a prefix_refinable provider, passing
+    on completions that have already been normalised
+    """
 
-def normalise_completion(c):
-    def split_trigger(trigger):
-        idx = trigger.find("\t")
-        if idx < 0:
-            return (trigger, "")
-        else:
-            return (trigger[0:idx], trigger[idx + 1:])
-
-    if not isinstance(c, sublime.CompletionItem):
-        if isinstance(c, str):
-            trigger, annotation = split_trigger(c)
-            c = sublime.CompletionItem(trigger, annotation)
-        elif len(c) == 1:
-            trigger, annotation = split_trigger(c[0])
-            c = sublime.CompletionItem(trigger, annotation)
-        elif len(c) == 2:
-            trigger, annotation = split_trigger(c[0])
-            c = sublime.CompletionItem.snippet_completion(
-                trigger,
-                c[1],
-                annotation,
-                kind=sublime.KIND_AMBIGUOUS
-            )
-        elif len(c) == 3:
-            trigger, annotation = split_trigger(c[0])
-            c = sublime.CompletionItem.snippet_completion(
-                trigger,
-                c[2],
-                annotation,
-                kind=sublime.KIND_AMBIGUOUS
-            )
-        else:
-            c = sublime.CompletionItem("")
+    def __init__(self, completions, flags):
+        self.completions = completions
+        self.flags = flags
 
-    kind, kind_letter, kind_name = c.kind
+    def _set_target(self, target):
+        target.normalised_completions_ready(self.completions, self.flags)
 
-    letter = 0
-    if isinstance(kind_letter, str) and kind_letter != '':
-        letter = ord(kind_letter)
-    return (c.trigger, c.annotation, c.details, c.completion, kind_name, letter, c.completion_format, c.flags, kind)
 
+class RefinementRecorder:
+    """
+    Sits between the CompletionList of a prefix_refinable provider and the
+    MultiCompletionList, recording the completions for later queries. The
+    empty list a parallel provider gets when it misses its deadline isn't
+    recorded, nor are completions flagged with DYNAMIC_COMPLETIONS, which
+    ask for the provider to be queried again as the user types.
+    """
 
-class MultiCompletionList:
-    def __init__(self, num_completion_lists, view_id, req_id):
-        self.remaining_calls = num_completion_lists
-        self.view_id = view_id
-        self.req_id = req_id
-        self.completions = []
-        self.flags = 0
+    def __init__(self, results, key, target, deadline=None):
+        self.results = results
+        self.key = key
+        self.target = target
+        self.deadline = deadline
 
     def completions_ready(self, completions, flags):
-        self.completions += [normalise_completion(c) for c in completions]
-        self.flags |= flags
-        self.remaining_calls -= 1
-
-        if self.remaining_calls == 0:
-            sublime_api.view_set_completions(
-                self.view_id, self.req_id, (self.completions, self.flags))
+        normalised = normalise_completions(completions)
+        expired = self.deadline is not None and self.deadline.expired
+        if not expired and not flags & sublime.DYNAMIC_COMPLETIONS:
+            self.results[self.key] = (normalised, flags)
+        self.target.normalised_completions_ready(normalised, flags)
 
 
 def on_query_completions(view_id, req_id, prefix, locations):
@@ -1059,18 +2501,79 @@ def on_query_completions(view_id, req_id, prefix, locations):
         elif isinstance(res, sublime.CompletionList):
             completion_lists.append(res)
 
+    providers = []
     for callback in el_callbacks('on_query_completions'):
-        norm_res(callback(v, prefix, locations))
-
+        providers.append((callback, (v, prefix, locations)))
     for callback in vel_callbacks(v, 'on_query_completions'):
-        norm_res(callback(prefix, locations))
+        providers.append((callback, (prefix, locations)))
+
+    # The previous completions of prefix_refinable providers can be reused if
+    # the word being completed starts at the same point, and the only changes
+    # since are the characters typed onto the previous prefix
+    context = (locations[0] - len(prefix), len(locations)) if locations else None
+    change_count = v.change_count()
+    previous_results = {}
+    previous = completion_refinement_cache.get(view_id)
+    if previous is not None:
+        prev_context, prev_prefix, prev_change_count, prev_results = previous
+        if (context is not None
+                and prev_context == context
+                and prefix.startswith(prev_prefix)
+                and change_count - prev_change_count == len(prefix) - len(prev_prefix)):
+            previous_results = prev_results
+    refinement_results = {}
+    completion_refinement_cache[view_id] = (context, prefix, change_count, refinement_results)
+
+    refinable = {}
+    cached_lists = {}
+    for i, (callback, args) in enumerate(providers):
+        if getattr(callback, 'prefix_refinable', False):
+            refinable[i] = callback
+            if callback in previous_results:
+                completions, flags = previous_results[callback]
+                completions = refine_completions(completions, prefix)
+                refinement_results[callback] = (completions, flags)
+                cached_lists[i] = CachedCompletionList(completions, flags)
+
+    # Start the parallel providers first, so they overlap with the others
+    deferred_lists = {}
+    for i, (callback, args) in enumerate(providers):
+        if i in cached_lists:
+            continue
+        if getattr(callback, 'parallel_completions', False):
+            deferred = DeadlineCompletionList(completion_deadline_ms)
+            get_completion_executor().submit(callback, *args).add_done_callback(
+                deferred.provider_done)
+            deferred_lists[i] = deferred
+
+    # Lists of refinable providers are recorded on their way to the mlist
+    recorded_lists = {}
+    for i, (callback, args) in enumerate(providers):
+        if i in cached_lists:
+            completion_lists.append(cached_lists[i])
+            continue
+        num_lists = len(completion_lists)
+        deferred = deferred_lists.get(i)
+        if deferred is not None:
+            completion_lists.append(deferred.completion_list)
+        else:
+            norm_res(callback(*args))
+        if i in refinable and len(completion_lists) > num_lists:
+            recorded_lists[num_lists] = (refinable[i], deferred)
 
     if not completion_lists:
         completion_lists = [sublime.CompletionList([])]
 
     mlist = MultiCompletionList(len(completion_lists), view_id, req_id)
-    for cl in completion_lists:
-        cl._set_target(mlist)
+    for i, cl in enumerate(completion_lists):
+        if i in recorded_lists:
+            key, deferred = recorded_lists[i]
+            cl._set_target(RefinementRecorder(refinement_results, key, mlist, deferred))
+        else:
+            cl._set_target(mlist)
+
+    if deadline_completions:
+        mlist.finalise_after(completion_request_deadline_ms)
 
 
 def on_hover(view_id, point, hover_zone):
@@ -1237,13 +2740,14 @@ class CommandInputHandler:
         return self.validate(v)
 
     def cancel_(self):
-        self.cancel()
+        schedule_if_coroutine(self.cancel(), self.name(), self.__class__.__module__)
 
     def confirm_(self, v, event):
         if self.want_event():
-            self.confirm(v, event)
+            res = self.confirm(v, event)
         else:
-            self.confirm(v)
+            res = self.confirm(v)
+        schedule_if_coroutine(res, self.name(), self.__class__.__module__)
 
     def want_event(self):
         return False
@@ -1449,9 +2953,10 @@ class ApplicationCommand(Command):
         args = self.filter_args(args)
         try:
             if args:
-                return self.run(**args)
+                res = self.run(**args)
             else:
-                return self.run()
+                res = self.run()
+            return schedule_if_coroutine(res, self.name(), self.__class__.__module__)
         except (TypeError) as e:
             if 'required positional argument' in str(e):
                 if sublime_api.can_accept_input(self.name(), args):
@@ -1478,9 +2983,10 @@ class WindowCommand(Command):
         args = self.filter_args(args)
         try:
             if args:
-                return self.run(**args)
+                res = self.run(**args)
             else:
-                return self.run()
+                res = self.run()
+            return schedule_if_coroutine(res, self.name(), self.__class__.__module__)
         except (TypeError) as e:
             if 'required positional argument' in str(e):
                 if sublime_api.window_can_accept_input(self.window.id(), self.name(), args):
@@ -1510,15 +3016,24 @@ class TextCommand(Command):
             if args:
                 edit = self.view.begin_edit(edit_token, self.name(), args)
                 try:
-                    return self.run(edit, **args)
+                    res = self.run(edit, **args)
                 finally:
                     self.view.end_edit(edit)
             else:
                 edit = self.view.begin_edit(edit_token, self.name())
                 try:
-                    return self.run(edit)
+                    res = self.run(edit)
                 finally:
                     self.view.end_edit(edit)
+            # The edit ends when run() returns, so can't be used by a coroutine
+            if res.__class__ is types.CoroutineType:
+                res.close()
+                raise TypeError(
+                    f'{self.__class__.__name__}.run() must not be a coroutine, as its edit '
+                    'object is only valid until it returns - start the coroutine with '
+                    'sublime_plugin.run_coroutine() and make changes from it with '
+                    'view.run_command()')
+            return res
         except (TypeError) as e:
             if 'required positional argument' in str(e):
                 if sublime_api.view_can_accept_input(self.view.id(), self.name(), args):
@@ -1551,6 +3066,10 @@ class ViewEventListener:
     def applies_to_primary_view_only(cls):
         return True
 
+    @classmethod
+    def applicable_settings_keys(cls):
+        return None
+
     def __init__(self, view):
         self.view = view
 
@@ -1588,8 +3107,22 @@ class TextChangeListener:
 
     on_reload_async():
         Async version of on_reload_async.
+
+    Setting columnar_changes to True on a subclass passes the changes to
+    on_text_changed() and on_text_changed_async() as a TextChangeBatch,
+    rather than a list of TextChange. The batch is built from the list the
+    host passes, so this trades extra CPU time on every change for holding
+    the changes compactly; it only pays off for listeners that keep batches
+    around or scan them repeatedly.
+
+    Setting coalesce_changes to True on a subclass merges all the batches of
+    changes that are pending by the time on_text_changed_async() runs into
+    one list of non-overlapping changes, which it is called with once.
     """
 
+    columnar_changes = False
+    coalesce_changes = False
+
     @classmethod
     def is_applicable(cls, buffer):
         return True
@@ -1642,6 +3175,912 @@ class TextChangeListener:
         return self.__key is not None
 
 
+class TextChangeBatch:
+    """ A batch of text changes, held as one array per attribute.
+
+    Passed to the on_text_changed() and on_text_changed_async() callbacks of
+    TextChangeListener classes setting columnar_changes, in place of a list of
+    TextChange. The attributes of the HistoricPositions a and b of the changes
+    are in the a_* and b_* arrays, and the inserted strs are concatenated in
+    text, with change i's at text[text_offsets[i]:text_offsets[i + 1]].
+
+    Indexing or iterating over the batch creates TextChange objects on demand,
+    so it may be used in place of the list.
+
+    Converting a list to a batch costs CPU time, in exchange for the batch
+    taking far less memory than the TextChange objects.
+    """
+
+    __slots__ = [
+        'a_pt',
+        'a_row',
+        'a_col',
+        'a_col_utf16',
+        'a_col_utf8',
+        'b_pt',
+        'b_row',
+        'b_col',
+        'b_col_utf16',
+        'b_col_utf8',
+        'len_utf16',
+        'len_utf8',
+        'text',
+        'text_offsets'
+    ]
+
+    def __init__(self, changes=()):
+        """
+        :param changes:
+            A list of TextChange
+        """
+        self.a_pt = array.array('q', [c.a.pt for c in changes])
+        self.a_row = array.array('q', [c.a.row for c in changes])
+        self.a_col = array.array('q', [c.a.col for c in changes])
+        self.a_col_utf16 = array.array('q', [c.a.col_utf16 for c in changes])
+        self.a_col_utf8 = array.array('q', [c.a.col_utf8 for c in changes])
+        self.b_pt = array.array('q', [c.b.pt for c in changes])
+        self.b_row = array.array('q', [c.b.row for c in changes])
+        self.b_col = array.array('q', [c.b.col for c in changes])
+        self.b_col_utf16 = array.array('q', [c.b.col_utf16 for c in changes])
+        self.b_col_utf8 = array.array('q', [c.b.col_utf8 for c in changes])
+        self.len_utf16 = array.array('q', [c.len_utf16 for c in changes])
+        self.len_utf8 = array.array('q', [c.len_utf8 for c in changes])
+
+        strs = [c.str for c in changes]
+        self.text = ''.join(strs)
+        self.text_offsets = array.array('q', itertools.accumulate(map(len, strs), initial=0))
+
+    def __len__(self):
+        return len(self.a_pt)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('TextChangeBatch index out of range')
+
+        return sublime.TextChange(
+            sublime.HistoricPosition(
+                self.a_pt[index],
+                self.a_row[index],
+                self.a_col[index],
+                self.a_col_utf16[index],
+                self.a_col_utf8[index]),
+            sublime.HistoricPosition(
+                self.b_pt[index],
+                self.b_row[index],
+                self.b_col[index],
+                self.b_col_utf16[index],
+                self.b_col_utf8[index]),
+            self.len_utf16[index],
+            self.len_utf8[index],
+            self.str(index))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f'TextChangeBatch({len(self)} changes)'
+
+    def str(self, index):
+        """ The str inserted by a change, without creating the TextChange. """
+        return self.text[self.text_offsets[index]:self.text_offsets[index + 1]]
+
+    def texts(self):
+        """ An iterator over the strs inserted by each change. """
+        text = self.text
+        offsets = self.text_offsets
+        return (text[a:b] for a, b in zip(offsets, offsets[1:]))
+
+
+def deliver_columnar(event_handler):
+    """
+    Decorator passing the list of TextChange to an on_text_changed() or
+    on_text_changed_async() method as a TextChangeBatch. Each list is only
+    converted once: on_text_changed() hands the batch it built on to
+    on_text_changed_async(), which only converts lists it wasn't handed.
+
+    :param event_handler:
+        The event handler method - must be an unbound method
+
+    :return:
+        The decorated method
+    """
+
+    if event_handler.__name__ == 'on_text_changed_async':
+        def columnar(self, changes):
+            if isinstance(changes, TextChangeBatch):
+                return event_handler(self, changes)
+            # The (list, batch) pairs built by on_text_changed(), oldest first
+            handed_on = self.__dict__.get('columnar_batches')
+            if handed_on is None:
+                self.__dict__.setdefault('columnar_batches', collections.deque())
+            else:
+                while handed_on:
+                    host_changes, batch = handed_on.popleft()
+                    if host_changes is changes:
+                        return event_handler(self, batch)
+            return event_handler(self, TextChangeBatch(changes))
+    else:
+        def columnar(self, changes):
+            if not isinstance(changes, TextChangeBatch):
+                batch = TextChangeBatch(changes)
+                # Only set once the class's on_text_changed_async() has run
+                handed_on = self.__dict__.get('columnar_batches')
+                if handed_on is not None:
+                    handed_on.append((changes, batch))
+                changes = batch
+            return event_handler(self, changes)
+
+    return _copy_handler_attributes(event_handler, columnar)
+
+
+def queue_text_changes(cls):
+    """
+    Has the on_text_changed() method of a TextChangeListener class setting
+    coalesce_changes queue each batch of changes for on_text_changed_async(),
+    adding the method if the class doesn't define it.
+
+    A subclass of such a class gets its own queuing method when it overrides
+    on_text_changed(), so each batch is only queued by the outermost call,
+    not again by base class methods called through super().
+
+    :param cls:
+        The TextChangeListener class
+    """
+
+    event_handler = getattr(cls, 'on_text_changed', None)
+    if getattr(event_handler, 'queues_text_changes', False):
+        return
+
+    def queuer(self, changes):
+        if self.__dict__.get('queuing_text_changes', False):
+            if event_handler is not None:
+                event_handler(self, changes)
+            return
+
+        pending = self.__dict__.get('pending_text_changes')
+        if pending is None:
+            pending = self.__dict__.setdefault('pending_text_changes', collections.deque())
+        pending.append(changes)
+        if event_handler is not None:
+            self.queuing_text_changes = True
+            try:
+                event_handler(self, changes)
+            finally:
+                self.queuing_text_changes = False
+
+    if event_handler is not None:
+        _copy_handler_attributes(event_handler, queuer)
+    queuer.__name__ = 'on_text_changed'
+    queuer.queues_text_changes = True
+    cls.on_text_changed = queuer
+
+
+# The number of pending changes above which on_text_changed_async() is
+# called with each batch in turn rather than merging them, as the time
+# merge_text_changes() takes grows with the square of the number of changes
+coalesce_changes_limit = 256
+
+
+def deliver_coalesced(event_handler):
+    """
+    Decorator for the on_text_changed_async() method of a TextChangeListener
+    class setting coalesce_changes. The first call merges every batch queued
+    by on_text_changed() so far, and the calls for the batches it included
+    are skipped. If the batches hold more than coalesce_changes_limit changes
+    in total, they are passed on one at a time instead.
+
+    :param event_handler:
+        The event handler method - must be an unbound method
+
+    :return:
+        The decorated method
+    """
+
+    def coalescer(self, changes):
+        pending = self.__dict__.get('pending_text_changes')
+        if not pending:
+            return
+
+        batches = []
+        while pending:
+            batches.append(pending.popleft())
+        if len(batches) == 1:
+            return event_handler(self, batches[0])
+        if sum(map(len, batches)) > coalesce_changes_limit:
+            for changes in batches:
+                event_handler(self, changes)
+            return None
+        return event_handler(self, merge_text_changes(batches))
+
+    return _copy_handler_attributes(event_handler, coalescer)
+
+
+def utf16_len(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def advance_position(pos, text):
+    """
+    :param pos:
+        A (pt, row, col, col_utf16, col_utf8) tuple
+
+    :param text:
+        A str inserted at pos
+
+    :return:
+        The (pt, row, col, col_utf16, col_utf8) tuple of the end of text
+    """
+
+    pt, row, col, col_utf16, col_utf8 = pos
+    newlines = text.count('\n')
+    if newlines == 0:
+        return (pt + len(text), row, col + len(text), col_utf16 + utf16_len(text), col_utf8 + len(text.encode()))
+    last = text[text.rfind('\n') + 1:]
+    return (pt + len(text), row + newlines, len(last), utf16_len(last), len(last.encode()))
+
+
+def rebase_position(pos, old_end, new_end):
+    """
+    :param pos:
+        A (pt, row, col, col_utf16, col_utf8) tuple at or after old_end
+
+    :param old_end:
+        The position tuple of the end of a region, before it was replaced
+
+    :param new_end:
+        The position tuple of the end of the text the region was replaced
+        with
+
+    :return:
+        The position tuple pos moves to
+    """
+
+    pt, row, col, col_utf16, col_utf8 = pos
+    pt += new_end[0] - old_end[0]
+    if row != old_end[1]:
+        return (pt, row + new_end[1] - old_end[1], col, col_utf16, col_utf8)
+    return (
+        pt,
+        new_end[1],
+        new_end[2] + col - old_end[2],
+        new_end[3] + col_utf16 - old_end[3],
+        new_end[4] + col_utf8 - old_end[4])
+
+
+class MergedTextChange:
+    """
+    A region of the oldest version of the text, and the text it has been
+    replaced with in the current version, used by merge_text_changes()
+    """
+
+    __slots__ = ['old_a', 'old_b', 'len_utf16', 'len_utf8', 'start', 'end', 'text']
+
+    def __init__(self, old_a, old_b, len_utf16, len_utf8, start, text):
+        self.old_a = old_a
+        self.old_b = old_b
+        self.len_utf16 = len_utf16
+        self.len_utf8 = len_utf8
+        self.start = start
+        self.end = advance_position(start, text)
+        self.text = text
+
+
+def merge_text_changes(batches):
+    """
+    Merges consecutive batches of changes into the fewest changes having the
+    same effect, none of which overlap or touch. Their positions are all in
+    the text from before the first batch, and they are ordered from the end
+    of the text to the start, so may be applied in turn like any batch.
+
+    :param batches:
+        A list of lists of TextChange, or TextChangeBatch
+
+    :return:
+        A list of TextChange
+    """
+
+    # Sorted by position, with start and end in the current version
+    merged = []
+
+    for changes in batches:
+        for change in changes:
+            a = change.a
+            b = change.b
+            a = (a.pt, a.row, a.col, a.col_utf16, a.col_utf8)
+            b = (b.pt, b.row, b.col, b.col_utf16, b.col_utf8)
+            text = change.str
+
+            # The merged changes overlapping or touching this one
+            first = 0
+            while first < len(merged) and merged[first].end[0] < a[0]:
+                first += 1
+            last = first
+            while last < len(merged) and merged[last].start[0] <= b[0]:
+                last += 1
+            overlapping = merged[first:last]
+            previous = merged[first - 1] if first > 0 else None
+
+            # The removed text that wasn't inserted by an earlier change
+            len_utf16 = change.len_utf16
+            len_utf8 = change.len_utf8
+            for m in overlapping:
+                part = m.text[max(a[0], m.start[0]) - m.start[0]:min(b[0], m.end[0]) - m.start[0]]
+                len_utf16 += m.len_utf16 - utf16_len(part)
+                len_utf8 += m.len_utf8 - len(part.encode())
+
+            if overlapping and overlapping[0].start[0] <= a[0]:
+                start = overlapping[0].start
+                old_a = overlapping[0].old_a
+                text = overlapping[0].text[:a[0] - start[0]] + text
+            else:
+                start = a
+                old_a = a if previous is None else rebase_position(a, previous.end, previous.old_b)
+
+            if overlapping and overlapping[-1].end[0] >= b[0]:
+                old_b = overlapping[-1].old_b
+                text += overlapping[-1].text[b[0] - overlapping[-1].start[0]:]
+            else:
+                if overlapping:
+                    previous = overlapping[-1]
+                old_b = b if previous is None else rebase_position(b, previous.end, previous.old_b)
+
+            new_end = advance_position(a, change.str)
+            for m in merged[last:]:
+                m.start = rebase_position(m.start, b, new_end)
+                m.end = rebase_position(m.end, b, new_end)
+
+            if text or old_a[0] != old_b[0]:
+                merged[first:last] = [MergedTextChange(old_a, old_b, len_utf16, len_utf8, start, text)]
+            else:
+                del merged[first:last]
+
+    return [
+        sublime.TextChange(
+            sublime.HistoricPosition(*m.old_a),
+            sublime.HistoricPosition(*m.old_b),
+            m.len_utf16,
+            m.len_utf8,
+            m.text)
+        for m in reversed(merged)
+    ]
+
+
+class TextBufferMirror(TextChangeListener):
+    """ A text change listener keeping a copy of the text of its buffer.
+
+    The copy is updated from the changes passed to on_text_changed(), rather
+    than being read out of the buffer, so plugins needing the whole document
+    after every modification don't copy it each time. The text is held in
+    chunks of at most CHUNK_SIZE characters, so an edit only rebuilds the
+    chunks it touches, and reading a region only joins the chunks it spans.
+
+    The copy is reread from the buffer when attaching, and on revert and
+    reload. It may be read from any thread.
+
+    Subclasses overriding any of the callbacks must call the base
+    implementation.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.chunks = []
+        self.offsets = []
+        self.length = 0
+        self.snapshot = ''
+
+    def attach(self, buffer):
+        super().attach(buffer)
+        self.resync()
+
+    def resync(self):
+        """ Replace the copy with the current text of the buffer. """
+        view = self.buffer.primary_view()
+        text = view.substr(sublime.Region(0, view.size()))
+
+        with self.lock:
+            self.chunks = []
+            self.offsets = []
+            self.length = 0
+            self.snapshot = None
+            self._replace(0, 0, text)
+
+    def on_text_changed(self, changes):
+        with self.lock:
+            if isinstance(changes, TextChangeBatch):
+                for a, b, text in zip(changes.a_pt, changes.b_pt, changes.texts()):
+                    self._replace(a, b, text)
+            else:
+                for change in changes:
+                    self._replace(change.a.pt, change.b.pt, change.str)
+
+    def on_revert(self):
+        self.resync()
+
+    def on_reload(self):
+        self.resync()
+
+    def _locate(self, pt):
+        i = bisect.bisect_right(self.offsets, pt) - 1
+        return max(i, 0)
+
+    def _replace(self, a, b, text):
+        chunks = self.chunks
+        size = self.CHUNK_SIZE
+
+        if not chunks:
+            first = last = 0
+            new_text = text
+        else:
+            first = self._locate(a)
+            last = self._locate(b)
+            new_text = (chunks[first][:a - self.offsets[first]]
+                        + text
+                        + chunks[last][b - self.offsets[last]:])
+            last += 1
+            # Merge small pieces into the following chunk, to avoid the list
+            # filling up with tiny chunks while typing
+            if len(new_text) < size // 4 and last < len(chunks):
+                new_text += chunks[last]
+                last += 1
+
+        start = self.offsets[first] if self.offsets else 0
+        chunks[first:last] = [new_text[i:i + size] for i in range(0, len(new_text), size)]
+
+        del self.offsets[first:]
+        if first < len(chunks):
+            self.offsets.extend(itertools.accumulate(map(len, chunks[first:-1]), initial=start))
+        self.length += len(text) - (b - a)
+        self.snapshot = None
+
+    def size(self):
+        """ The number of characters in the copy of the buffer. """
+        return self.length
+
+    def substr(self, x):
+        """ The text of a region, or the character at a point.
+
+        :param x:
+            A sublime.Region or an int point
+
+        :return:
+            A str
+        """
+        if isinstance(x, sublime.Region):
+            a = max(x.begin(), 0)
+            b = min(x.end(), self.length)
+        else:
+            a = x
+            b = x + 1
+            if a < 0 or b > self.length:
+                return '\x00'
+
+        with self.lock:
+            if a >= b:
+                return ''
+            if self.snapshot is not None:
+                return self.snapshot[a:b]
+
+            first = self._locate(a)
+            last = self._locate(b - 1)
+            offset = self.offsets[first]
+            if first == last:
+                return self.chunks[first][a - offset:b - offset]
+            return ''.join(self.chunks[first:last + 1])[a - offset:b - offset]
+
+    def text(self):
+        """ The whole text of the copy of the buffer.
+
+        The str is cached until the next change, so repeated calls are cheap.
+        """
+        with self.lock:
+            if self.snapshot is None:
+                self.snapshot = ''.join(self.chunks)
+            return self.snapshot
+
+
+class TextLineIndex(TextChangeListener):
+    """ A text change listener indexing where the lines of its buffer start.
+
+    Converts between points and (row, col) pairs without calling into the
+    API for each one, and may be used from any thread, so plugins converting
+    thousands of positions can do so in one call off the main thread.
+
+    The length of each line, including its newline, is kept in an array. A
+    change only replaces the lengths of the rows it spans, which are read
+    from its HistoricPositions. The sorted array of line starts used for
+    lookups is rebuilt from the first modified line by the next conversion.
+
+    The index is rebuilt from the buffer when attaching, and on revert and
+    reload.
+
+    Subclasses overriding any of the callbacks must call the base
+    implementation.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.lengths = array.array('q', [0])
+        self.starts = array.array('q', [0])
+        self.dirty_row = 1
+
+    def attach(self, buffer):
+        super().attach(buffer)
+        self.resync()
+
+    def resync(self):
+        """ Rebuild the index from the current text of the buffer. """
+        view = self.buffer.primary_view()
+        text = view.substr(sublime.Region(0, view.size()))
+
+        with self.lock:
+            self._reset(text)
+
+    def _reset(self, text):
+        lengths = array.array('q', [len(line) + 1 for line in text.split('\n')])
+        lengths[-1] -= 1
+        self.lengths = lengths
+        self.starts = array.array('q', [0])
+        self.dirty_row = 1
+
+    def on_text_changed(self, changes):
+        with self.lock:
+            if isinstance(changes, TextChangeBatch):
+                for values in zip(changes.a_row, changes.a_col, changes.b_row, changes.b_col, changes.texts()):
+                    self._apply(*values)
+            else:
+                for change in changes:
+                    self._apply(change.a.row, change.a.col, change.b.row, change.b.col, change.str)
+
+    def on_revert(self):
+        self.resync()
+
+    def on_reload(self):
+        self.resync()
+
+    def _apply(self, a_row, a_col, b_row, b_col, text):
+        lengths = self.lengths
+
+        prefix = a_col
+        suffix = lengths[b_row] - b_col
+        parts = text.split('\n')
+        if len(parts) == 1:
+            new_lengths = [prefix + len(parts[0]) + suffix]
+        else:
+            new_lengths = [prefix + len(parts[0]) + 1]
+            new_lengths.extend(len(part) + 1 for part in parts[1:-1])
+            new_lengths.append(len(parts[-1]) + suffix)
+
+        lengths[a_row:b_row + 1] = array.array('q', new_lengths)
+        self.dirty_row = min(self.dirty_row, a_row + 1)
+
+    def _line_starts(self):
+        # Brings the line starts up to date, the lock must be held
+        starts = self.starts
+        row = self.dirty_row
+        num_rows = len(self.lengths)
+        if row < num_rows or len(starts) != num_rows:
+            start = starts[row - 1]
+            del starts[row - 1:]
+            starts.extend(itertools.accumulate(self.lengths[row - 1:-1], initial=start))
+            self.dirty_row = num_rows
+        return starts
+
+    def line_count(self):
+        """ The number of lines in the buffer. """
+        return len(self.lengths)
+
+    def size(self):
+        """ The number of characters in the buffer. """
+        with self.lock:
+            return self._line_starts()[-1] + self.lengths[-1]
+
+    def rowcol(self, pt):
+        """ Convert a point to a 0-based (row, col) pair, like View.rowcol(). """
+        return self.rowcols([pt])[0]
+
+    def rowcols(self, points):
+        """ Convert points to 0-based (row, col) pairs.
+
+        :param points:
+            An iterable of int points
+
+        :return:
+            A list of (int, int) tuples
+        """
+        with self.lock:
+            return self._rowcols(points)
+
+    def _rowcols(self, points):
+        starts = self._line_starts()
+        size = starts[-1] + self.lengths[-1]
+        find = bisect.bisect_right
+        result = []
+        for pt in points:
+            pt = min(max(pt, 0), size)
+            row = find(starts, pt) - 1
+            result.append((row, pt - starts[row]))
+        return result
+
+    def text_point(self, row, col, *, clamp_column=False):
+        """ Convert a 0-based row and column to a point, like View.text_point(). """
+        return self.text_points([(row, col)], clamp_column=clamp_column)[0]
+
+    def text_points(self, rowcols, *, clamp_column=False):
+        """ Convert 0-based (row, col) pairs to points.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :param clamp_column:
+            A bool, if col should be restricted to valid values for the row
+
+        :return:
+            A list of int points
+        """
+        with self.lock:
+            return self._text_points(rowcols, clamp_column)
+
+    def _text_points(self, rowcols, clamp_column):
+        starts = self._line_starts()
+        lengths = self.lengths
+        last_row = len(lengths) - 1
+        size = starts[-1] + lengths[-1]
+        result = []
+        for row, col in rowcols:
+            row = min(max(row, 0), last_row)
+            if clamp_column:
+                col = min(col, lengths[row] - (row != last_row))
+            result.append(min(max(starts[row] + col, 0), size))
+        return result
+
+
+def scan_wide_chars(text, col):
+    """
+    Finds the characters of a line that take more than one UTF-16 or UTF-8
+    code unit
+
+    :param text:
+        The str of (part of) a line
+
+    :param col:
+        The int column text starts at
+
+    :return:
+        A list of (col, extra UTF-16 units, extra UTF-8 units) tuples
+    """
+
+    if text.isascii():
+        return []
+
+    entries = []
+    for i, ch in enumerate(text, col):
+        cp = ord(ch)
+        if cp < 0x80:
+            continue
+        if cp < 0x800:
+            entries.append((i, 0, 1))
+        elif cp < 0x10000:
+            entries.append((i, 0, 2))
+        else:
+            entries.append((i, 1, 3))
+    return entries
+
+
+def column_table(entries):
+    """
+    Builds the lookup table of a line from its scan_wide_chars() entries
+
+    :param entries:
+        A list of (col, extra UTF-16 units, extra UTF-8 units) tuples
+
+    :return:
+        None if the line is ASCII only, otherwise a tuple of the columns of
+        the wide characters, the UTF-16 and UTF-8 units to add to a column
+        before each of them, and the UTF-16 and UTF-8 columns after each
+    """
+
+    if not entries:
+        return None
+
+    cols = [e[0] for e in entries]
+    extra16 = list(itertools.accumulate((e[1] for e in entries), initial=0))
+    extra8 = list(itertools.accumulate((e[2] for e in entries), initial=0))
+    ends16 = [c + 1 + x for c, x in zip(cols, extra16[1:])]
+    ends8 = [c + 1 + x for c, x in zip(cols, extra8[1:])]
+    return (cols, extra16, extra8, ends16, ends8)
+
+
+def column_table_entries(table, start, end, shift):
+    if table is None:
+        return []
+
+    cols, extra16, extra8 = table[0], table[1], table[2]
+    first = bisect.bisect_left(cols, start)
+    last = len(cols) if end is None else bisect.bisect_left(cols, end)
+    return [
+        (cols[i] + shift, extra16[i + 1] - extra16[i], extra8[i + 1] - extra8[i])
+        for i in range(first, last)
+    ]
+
+
+class TextColumnIndex(TextLineIndex):
+    """ A TextLineIndex which also converts columns to and from UTF-16 and
+    UTF-8 code units, such as for the positions used by language servers.
+
+    ASCII only lines need no table. Other lines have a table of the columns
+    of their non-ASCII characters, which a change splits and joins using the
+    columns of its HistoricPositions and the text it inserted.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.columns = [None]
+
+    def _reset(self, text):
+        super()._reset(text)
+        self.columns = [column_table(scan_wide_chars(line, 0)) for line in text.split('\n')]
+
+    def _apply(self, a_row, a_col, b_row, b_col, text):
+        columns = self.columns
+
+        head = column_table_entries(columns[a_row], 0, a_col, 0)
+        parts = text.split('\n')
+        tail_shift = len(parts[-1]) - b_col
+        if len(parts) == 1:
+            tail_shift += a_col
+        tail = column_table_entries(columns[b_row], b_col, None, tail_shift)
+
+        if len(parts) == 1:
+            tables = [column_table(head + scan_wide_chars(parts[0], a_col) + tail)]
+        else:
+            tables = [column_table(head + scan_wide_chars(parts[0], a_col))]
+            tables.extend(column_table(scan_wide_chars(part, 0)) for part in parts[1:-1])
+            tables.append(column_table(scan_wide_chars(parts[-1], 0) + tail))
+
+        columns[a_row:b_row + 1] = tables
+        super()._apply(a_row, a_col, b_row, b_col, text)
+
+    def _encode(self, rowcols, unit):
+        columns = self.columns
+        find = bisect.bisect_left
+        result = []
+        for row, col in rowcols:
+            table = columns[row]
+            if table is not None:
+                col += table[unit][find(table[0], col)]
+            result.append((row, col))
+        return result
+
+    def _decode(self, rowcols, unit):
+        columns = self.columns
+        last_row = len(columns) - 1
+        find = bisect.bisect_right
+        result = []
+        for row, col in rowcols:
+            row = min(max(row, 0), last_row)
+            table = columns[row]
+            if table is not None:
+                # A column within a character is moved to its start
+                i = find(table[unit + 2], col)
+                col -= table[unit][i]
+                if i < len(table[0]):
+                    col = min(col, table[0][i])
+            result.append((row, col))
+        return result
+
+    def rowcol_utf16(self, pt):
+        """ Convert a point to a 0-based (row, col) pair, with col in UTF-16
+        code units, like View.rowcol_utf16(). """
+        return self.rowcols_utf16([pt])[0]
+
+    def rowcols_utf16(self, points):
+        """ Convert points to 0-based (row, col) pairs, with col in UTF-16
+        code units.
+
+        :param points:
+            An iterable of int points
+
+        :return:
+            A list of (int, int) tuples
+        """
+        with self.lock:
+            return self._encode(self._rowcols(points), 1)
+
+    def rowcol_utf8(self, pt):
+        """ Convert a point to a 0-based (row, col) pair, with col in UTF-8
+        code units, like View.rowcol_utf8(). """
+        return self.rowcols_utf8([pt])[0]
+
+    def rowcols_utf8(self, points):
+        """ Convert points to 0-based (row, col) pairs, with col in UTF-8
+        code units.
+
+        :param points:
+            An iterable of int points
+
+        :return:
+            A list of (int, int) tuples
+        """
+        with self.lock:
+            return self._encode(self._rowcols(points), 2)
+
+    def text_point_utf16(self, row, col, *, clamp_column=False):
+        """ Convert a 0-based row and UTF-16 column to a point, like
+        View.text_point_utf16(). """
+        return self.text_points_utf16([(row, col)], clamp_column=clamp_column)[0]
+
+    def text_points_utf16(self, rowcols, *, clamp_column=False):
+        """ Convert 0-based (row, col) pairs, with col in UTF-16 code units,
+        to points.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :param clamp_column:
+            A bool, if col should be restricted to valid values for the row
+
+        :return:
+            A list of int points
+        """
+        with self.lock:
+            return self._text_points(self._decode(rowcols, 1), clamp_column)
+
+    def text_point_utf8(self, row, col, *, clamp_column=False):
+        """ Convert a 0-based row and UTF-8 column to a point, like
+        View.text_point_utf8(). """
+        return self.text_points_utf8([(row, col)], clamp_column=clamp_column)[0]
+
+    def text_points_utf8(self, rowcols, *, clamp_column=False):
+        """ Convert 0-based (row, col) pairs, with col in UTF-8 code units,
+        to points.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :param clamp_column:
+            A bool, if col should be restricted to valid values for the row
+
+        :return:
+            A list of int points
+        """
+        with self.lock:
+            return self._text_points(self._decode(rowcols, 2), clamp_column)
+
+    def utf16_to_utf8(self, rowcols):
+        """ Convert 0-based (row, col) pairs from UTF-16 to UTF-8 columns.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :return:
+            A list of (int, int) tuples
+        """
+        with self.lock:
+            return self._encode(self._decode(rowcols, 1), 2)
+
+    def utf8_to_utf16(self, rowcols):
+        """ Convert 0-based (row, col) pairs from UTF-8 to UTF-16 columns.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :return:
+            A list of (int, int) tuples
+        """
+        with self.lock:
+            return self._encode(self._decode(rowcols, 2), 1)
+
+
 class MultizipImporter(importlib.abc.MetaPathFinder):
     def __init__(self):
         self.loaders = []
@@ -3,6 +3,9 @@
 
 from __future__ import annotations
 
+import collections
+import concurrent.futures
+import threading
 from typing import (
     Any,
     Callable,
@@ -26,6 +29,7 @@ from _sublime_types import (
     CommandArgsDict,
     Completion,
     CompletionKind,
+    CompletionNormalized,
     Dip,
     HasKeysMethod,
     Layout,
@@ -603,6 +607,10 @@ def save_settings(base_name: str) -> None:
     ...
 
 
+# Set by sublime_plugin.start_stall_watchdog() to watch set_timeout() callbacks
+_main_thread_watchdog: Any = None
+
+
 def set_timeout(f: Callback0, timeout_ms: float = 0) -> None:
     """
     Schedules a function to be called in the future. Sublime Text will block
@@ -620,6 +628,117 @@ def set_timeout_async(f: Callback0, timeout_ms: float = 0) -> None:
     ...
 
 
+class _TimerWheel:
+    """
+    Multiplexes many logical timers onto few host timeouts. A host timeout is
+    only requested when a new timer is due before every timeout that has
+    already been requested, so a stream of debounce timers that keep being
+    pushed back costs a single host timeout at a time.
+
+    Cancelled timers are dropped from the heap once they make up half of it,
+    so timers that keep being cancelled and re-added with a long delay don't
+    keep their callbacks alive or grow the heap until they become due.
+    """
+
+    host_set_timeout: Callable[[Callback0, float], None]
+    lock: threading.Lock
+    timers: List[Tuple[float, int, concurrent.futures.Future[Any], Callback0]]
+    # The number of cancelled timers left in self.timers
+    cancelled: int
+    wakeups: List[float]
+    seq: int
+
+    def __init__(self, host_set_timeout: Callable[[Callback0, float], None]) -> None:
+        ...
+
+    def add(self, f: Callable[[], T], timeout_ms: float) -> concurrent.futures.Future[T]:
+        ...
+
+    def _discard(self, future: concurrent.futures.Future[Any]) -> None:
+        ...
+
+    def _arm(self, deadline: float, timeout_ms: float) -> None:
+        ...
+
+    def _fire(self, wakeup: float) -> None:
+        ...
+
+
+_main_timers: _TimerWheel
+_async_timers: _TimerWheel
+
+
+def set_timeout_future(f: Callable[[], T], timeout_ms: float = 0) -> concurrent.futures.Future[T]:
+    """
+    Like `set_timeout()`, but returns a `concurrent.futures.Future`. Calling
+    `cancel()` on it before `f` runs stops `f` from being run; its `result()` or
+    `exception()` is what `f` returned or raised. Do not wait on `result()` from
+    the main thread, as `f` is run there.
+    """
+    ...
+
+
+def set_timeout_async_future(f: Callable[[], T], timeout_ms: float = 0) -> concurrent.futures.Future[T]:
+    """
+    Like `set_timeout_async()`, but returns a `concurrent.futures.Future`. Calling
+    `cancel()` on it before `f` runs stops `f` from being run; its `result()` or
+    `exception()` is what `f` returned or raised.
+    """
+    ...
+
+
+class _MainThreadBatcher:
+    """
+    Collects callables to be run on the main thread, and runs as many as fit
+    in a time budget in a single set_timeout() tick, instead of each one
+    crossing into the host and getting a UI slice of its own.
+    """
+
+    budget_ms: float
+    queue: collections.deque[Callback0]
+    lock: threading.Lock
+    scheduled: bool
+    max_queue_length: int
+    drains: int
+    drained: int
+    drain_time: float
+    max_drain_time: float
+
+    def __init__(self, budget_ms: float = 10) -> None:
+        ...
+
+    def add(self, f: Callback0) -> None:
+        ...
+
+    def _drain(self) -> None:
+        ...
+
+    def stats(self) -> Dict[str, float]:
+        ...
+
+
+_main_thread_batcher: _MainThreadBatcher
+
+
+def set_timeout_batched(f: Callback0) -> None:
+    """
+    Schedules a function to be called on the main thread as soon as possible,
+    batched together with other functions scheduled this way. Batches are run
+    in a single tick, up to a time budget, so this is suited to many small
+    callbacks such as updating the status bar, regions or phantoms.
+    """
+    ...
+
+
+def batched_timeout_stats() -> Dict[str, float]:
+    """
+    Returns a dict of metrics of `set_timeout_batched()`: the current and
+    maximum queue length, the number of drain ticks and callables run, and
+    the total and maximum seconds spent draining.
+    """
+    ...
+
+
 def active_window() -> Window:
     """Returns the most recently used window."""
     ...
@@ -2759,6 +2878,7 @@ class CompletionItem:
     kind: CompletionKind
     details: str
     flags: int
+    _normalised: None | Tuple[CompletionKind, CompletionNormalized]
 
     def __init__(
         self,
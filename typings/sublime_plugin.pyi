@@ -3,6 +3,10 @@
 
 from __future__ import annotations
 
+import array
+import asyncio
+import collections
+import concurrent.futures
 import importlib.abc
 import io
 import os
@@ -11,13 +15,16 @@ from importlib.machinery import ModuleSpec
 from types import ModuleType
 from typing import (
     Any,
+    Awaitable,
     Callable,
+    Coroutine,
     Dict,
     Generator,
     Generic,
     Iterable,
     Iterator,
     List,
+    Literal,
     Sequence,
     Set,
     Tuple,
@@ -27,12 +34,29 @@ from typing import (
 )
 
 import sublime
-from _sublime_types import AnyCallable, Completion, CompletionNormalized, EventDict, Point, T_AnyCallable
+from _sublime_types import (
+    AnyCallable,
+    Completion,
+    CompletionKind,
+    CompletionNormalized,
+    EventDict,
+    Point,
+    Str,
+    T_AnyCallable,
+)
 
 # ----- #
 # types #
 # ----- #
 
+T = TypeVar("T")
+
+# A (pt, row, col, col_utf16, col_utf8) tuple
+PositionTuple = Tuple[int, int, int, int, int]
+
+# The lookup table of a line, see column_table()
+ColumnTable = None | Tuple[List[int], List[int], List[int], List[int], List[int]]
+
 InputType = None | str | int | float | Dict[str, Any] | List[Any] | Tuple[Any, ...]
 T_InputType = TypeVar("T_InputType", bound=InputType)
 
@@ -49,7 +73,9 @@ window_command_classes: List[Type] = []
 text_command_classes: List[Type] = []
 
 view_event_listener_classes: List[Type] = []
-view_event_listeners: Dict[int, List[ViewEventListener]] = {}
+view_event_listeners: Dict[int, Dict[Type[ViewEventListener], ViewEventListener]] = {}
+view_event_listener_handlers: Dict[int, Dict[str, Tuple[AnyCallable, ...]]] = {}
+view_settings_snapshots: Dict[int, Dict[str, Any]] = {}
 
 all_command_classes: List[List[Type]] = [application_command_classes, window_command_classes, text_command_classes]
 
@@ -107,6 +133,8 @@ all_callbacks: Dict[str, List[object]] = {
     "on_exit": [],
 }
 
+el_dispatch_tables: Dict[str, Tuple[AnyCallable, ...]] = {}
+
 pending_on_activated_async_lock: threading.Lock = threading.Lock()
 
 pending_on_activated_async_callbacks: Dict[str, List[Type]] = {"EventListener": [], "ViewEventListener": []}
@@ -150,7 +178,164 @@ text_change_listener_callbacks: Set[str] = {
 }
 text_change_listeners: Dict[int, List[TextChangeListener]] = {}
 
-profile: Dict[str, Dict[str, Any]] = {}
+# TextChangeListener callbacks which receive a TextChangeBatch, rather than a
+# list of TextChange, when the class sets columnar_changes
+columnar_callbacks: Set[str] = {"on_text_changed", "on_text_changed_async"}
+
+# Async events which fire in bursts while typing, and may be coalesced by
+# decorating the handler with coalesced()
+coalescable_callbacks: Set[str] = {
+    "on_modified_async",
+    "on_selection_modified_async",
+}
+
+# The (view_id, change_count) an async view event was dispatched with, for
+# the handlers of that event running on the current thread
+dispatch_state: threading.local = threading.local()
+
+profile: Dict[str, Dict[str, Summary]] = {}
+
+# Only time 1 in every N calls of each blocking event handler
+profile_sample_interval: int = 1
+
+# The active TraceRecorder, if tracing has been started
+trace_recorder: None | TraceRecorder = None
+
+# The running StallWatchdog, if any
+stall_watchdog: None | StallWatchdog = None
+
+# The event loop coroutines returned by event handlers, application and window
+# commands and input handlers are run on, started by get_asyncio_loop()
+asyncio_loop: None | asyncio.AbstractEventLoop = None
+asyncio_loop_lock: threading.Lock = threading.Lock()
+
+# The running AsyncHandlerExecutor, if async handlers are dispatched onto a
+# thread pool rather than being run directly on the async worker thread
+async_executor: None | AsyncHandlerExecutor = None
+
+
+class ExceptionReporter:
+    """
+    Prints exceptions raised by event handlers. Each distinct failure is
+    identified by the handler, the exception type and the line that raised
+    it. The full traceback is printed the first time, after which repeats are
+    only counted, and a summary of them is printed periodically.
+    """
+
+    summary_interval: float
+    # fingerprint -> total number of occurrences
+    seen: Dict[Tuple[str, str, Type[BaseException], str, int], int]
+    # fingerprint -> occurrences since the last summary
+    repeats: Dict[Tuple[str, str, Type[BaseException], str, int], int]
+    summary_scheduled: bool
+    lock: threading.Lock
+
+    def __init__(self, summary_interval: float = 10.0) -> None:
+        """
+        :param summary_interval:
+            The number of seconds between summaries of repeated exceptions
+        """
+        ...
+
+    def report(self, name: str, module: str, e: Exception, include_stack: bool = True) -> None:
+        """
+        Must be called from the except block that caught e, so that the
+        frames of the traceback are still available
+
+        :param name:
+            A unicode string of the event handler name
+
+        :param module:
+            A unicode string of the module the event handler is defined in
+
+        :param e:
+            The Exception raised by the event handler
+
+        :param include_stack:
+            If the stack frames leading to the except block should be
+            included in the printed traceback
+        """
+        ...
+
+    def print_summary(self) -> None:
+        ...
+
+    def reset(self) -> None:
+        """
+        Forget all seen exceptions, so the next occurrence of each prints its
+        full traceback again
+        """
+        ...
+
+
+exception_reporter: ExceptionReporter = ExceptionReporter()
+
+
+def get_asyncio_loop() -> asyncio.AbstractEventLoop:
+    """
+    :return:
+        The asyncio event loop used to run coroutines returned by plugins,
+        which runs on its own thread and is started on first use
+    """
+    ...
+
+
+def run_coroutine(coro: Coroutine[Any, Any, T], name: str, module: str) -> concurrent.futures.Future[T]:
+    """
+    Schedules a coroutine on the asyncio loop thread, reporting any exception
+    it raises through exception_reporter
+
+    :param coro:
+        The coroutine object
+
+    :param name:
+        A unicode string of the name of the handler or command that returned
+        the coroutine
+
+    :param module:
+        A unicode string of the module the handler or command is defined in
+
+    :return:
+        A concurrent.futures.Future of the result of the coroutine
+    """
+    ...
+
+
+def schedule_if_coroutine(res: T, name: str, module: str) -> None | T:
+    """
+    Runs the result of a handler or command with run_coroutine() if it is a
+    coroutine
+
+    :param res:
+        The value returned by the handler or command
+
+    :param name:
+        A unicode string of the name of the handler or command
+
+    :param module:
+        A unicode string of the module the handler or command is defined in
+
+    :return:
+        None if res was a coroutine, otherwise res
+    """
+    ...
+
+
+def _copy_handler_attributes(event_handler: Callable[..., Any], wrapper: T_AnyCallable) -> T_AnyCallable:
+    """
+    Makes the function wrapping an event handler method look like the method,
+    for introspection
+
+    :param event_handler:
+        The event handler method being wrapped
+
+    :param wrapper:
+        The function wrapping it
+
+    :return:
+        wrapper
+    """
+    ...
 
 
 def add_profiling(event_handler: T_AnyCallable) -> T_AnyCallable:
@@ -180,6 +365,183 @@ def trap_exceptions(event_handler: T_AnyCallable) -> T_AnyCallable:
     ...
 
 
+def skip_if_stale(event_handler: T_AnyCallable) -> T_AnyCallable:
+    """
+    Decorator for async view event handlers, so they are not run if the view
+    has been modified since the event was dispatched, e.g. while the handler
+    was queued behind other work
+
+    :param event_handler:
+        The event handler method
+
+    :return:
+        The event handler, marked to be skipped when stale
+    """
+    ...
+
+
+def dispatch_change_count() -> None | int:
+    """
+    :return:
+        The View.change_count() observed when the async view event being
+        handled on this thread was dispatched, or None outside of one
+    """
+    ...
+
+
+def is_dispatch_current() -> bool:
+    """
+    Checks if the view of the async event being handled on this thread has
+    not been modified since the event was dispatched, so that results
+    computed for it are still valid. Always True outside of an async view
+    event.
+
+    :return:
+        A bool
+    """
+    ...
+
+
+def dispatch_target(args: Sequence[Any]) -> None | Tuple[str, int]:
+    """
+    :param args:
+        The arguments an event handler method was called with, including self
+
+    :return:
+        A hashable identifying the view, buffer or window the event is for,
+        or None
+    """
+    ...
+
+
+class AsyncHandlerExecutor:
+    """
+    Runs async event handlers on a bounded pool of threads, so a slow plugin
+    doesn't hold up the async handlers of every other plugin. Handlers with
+    the same key, a (plugin module, view) pair, run one at a time in the order
+    they were submitted, and no plugin runs handlers on more than
+    max_per_plugin threads at once.
+    """
+
+    max_workers: int
+    max_per_plugin: int
+    queues: Dict[Tuple[str, Any], collections.deque[Tuple[int, Callable[[Tuple[Any, ...]], Any], Tuple[Any, ...]]]]
+    ready: collections.deque[Tuple[str, Any]]
+    depths: Dict[str, int]
+    waits: Dict[str, Summary]
+    running: Dict[str, int]
+    cond: threading.Condition
+    stopped: bool
+    threads: List[threading.Thread]
+
+    def __init__(self, max_workers: int = 4, max_per_plugin: None | int = None) -> None:
+        """
+        :param max_workers:
+            The number of worker threads
+
+        :param max_per_plugin:
+            The number of threads one plugin's handlers may use at a time,
+            defaults to half of max_workers
+        """
+        ...
+
+    def start(self) -> None:
+        ...
+
+    def stop(self) -> None:
+        """
+        Stops the workers once all queued handlers have run
+        """
+        ...
+
+    def submit(self, key: Tuple[str, Any], fn: Callable[[Tuple[Any, ...]], Any], args: Tuple[Any, ...]) -> None:
+        """
+        :param key:
+            A (plugin, target) tuple - handlers with an equal key are run in
+            order, one at a time
+
+        :param fn:
+            A callable to be passed args
+
+        :param args:
+            A tuple of the handler arguments
+        """
+        ...
+
+    def _next_key(self) -> None | Tuple[str, Any]:
+        ...
+
+    def _work(self) -> None:
+        ...
+
+    def stats(self) -> List[Tuple[str, int, int, float, float]]:
+        """
+        :return:
+            A list of (plugin, queue_depth, count, max_wait, sum_wait) tuples,
+            with wait times in seconds
+        """
+        ...
+
+
+def start_async_executor(max_workers: int = 4, max_per_plugin: None | int = None) -> AsyncHandlerExecutor:
+    """
+    Starts dispatching async event handlers onto a thread pool
+
+    :param max_workers:
+        The number of worker threads
+
+    :param max_per_plugin:
+        The number of threads one plugin's handlers may use at a time,
+        defaults to half of max_workers
+
+    :return:
+        The running AsyncHandlerExecutor
+    """
+    ...
+
+
+def stop_async_executor() -> None:
+    """
+    Goes back to running async event handlers directly. Handlers already
+    queued on the thread pool still run.
+    """
+    ...
+
+
+def coalesced(interval_ms: int) -> Callable[[T_AnyCallable], T_AnyCallable]:
+    """
+    Decorator for on_modified_async() and on_selection_modified_async()
+    handlers of an EventListener or ViewEventListener. Events for the same
+    listener and view are collapsed into the latest one, which is only run
+    once no further events have arrived for interval_ms milliseconds.
+
+    :param interval_ms:
+        An int of the number of milliseconds the view must be idle for
+
+    :return:
+        A decorator marking the handler as coalesced
+    """
+    ...
+
+
+def coalesce_events(event_handler: T_AnyCallable, interval_ms: int) -> T_AnyCallable:
+    """
+    Wraps an async event handler so that a burst of calls for the same
+    listener and view results in a single call with the latest arguments,
+    made once the burst has been idle for interval_ms
+
+    :param event_handler:
+        The event handler method - must be an unbound method
+
+    :param interval_ms:
+        An int of the number of milliseconds to wait for further events
+
+    :return:
+        The decorated method
+    """
+    ...
+
+
 def decorate_handler(cls: Type, method_name: str) -> None:
     """
     Decorates an event handler method with exception trapping, and in the case
@@ -246,7 +608,32 @@ def create_view_event_listeners(classes: Iterable[Type[ViewEventListener]], view
     ...
 
 
-def check_view_event_listeners(view: sublime.View) -> None:
+def check_view_event_listeners(
+    view: sublime.View,
+    classes: None | Sequence[Type[ViewEventListener]] = None,
+) -> None:
+    ...
+
+
+def rebuild_view_event_listener_handlers(view_id: int) -> None:
+    """Rebuilds the `event name -> bound handlers` index of the ViewEventListeners attached to a view."""
+    ...
+
+
+def snapshot_view_settings(view: sublime.View) -> Dict[str, Any]:
+    """Gets the values of the settings keys declared by `ViewEventListener.applicable_settings_keys()`."""
+    ...
+
+
+def on_view_settings_changed(view: sublime.View) -> None:
+    """
+    Re-evaluates the applicability of the ViewEventListener classes of a view
+    after its settings changed. Classes that declare the settings keys they
+    depend on are skipped unless one of those keys changed value.
+
+    :param view:
+        The sublime.View object whose settings changed
+    """
     ...
 
 
@@ -254,6 +641,8 @@ def attach_view(view: sublime.View) -> None:
     ...
 
 
+check_all_views_on_detach: bool = False
+
 check_all_view_event_listeners_scheduled: bool = False
 
 
@@ -261,6 +650,15 @@ def check_all_view_event_listeners() -> None:
     ...
 
 
+pending_detached_buffer_ids: Set[int] = set()
+check_detached_buffer_views_scheduled: bool = False
+
+
+def check_detached_buffer_views() -> None:
+    """Re-checks the ViewEventListeners of the remaining views into buffers which had a view closed."""
+    ...
+
+
 def detach_view(view: sublime.View) -> None:
     ...
 
@@ -286,6 +684,15 @@ def plugin_module_for_obj(obj: object) -> str:
     ...
 
 
+def plugin_module_for_name(cm: str) -> str:
+    ...
+
+
+def rebuild_el_dispatch_table(name: str) -> None:
+    """Rebuilds the tuple of bound EventListener handlers for the event `name`."""
+    ...
+
+
 def el_callbacks(name: str, listener_only: bool = False) -> Generator[Type | str, None, None]:
     ...
 
@@ -361,9 +768,21 @@ def on_clone_async(view_id: int) -> None:
 
 
 class Summary:
+    """
+    Latency statistics for an event handler. Besides the count, sum and max,
+    durations are recorded in a fixed size histogram: each power of two is
+    split into SUB_BUCKETS linear buckets, so percentiles are accurate to
+    within roughly 6%.
+    """
+
+    SUB_BUCKETS: int
+    MIN_EXPONENT: int
+    MAX_EXPONENT: int
+
     max: float
     sum: float
     count: int
+    buckets: List[int]
 
     def __init__(self) -> None:
         ...
@@ -371,56 +790,267 @@ class Summary:
     def record(self, x: float) -> None:
         ...
 
+    def percentile(self, q: float) -> float:
+        """
+        :param q:
+            A float between 0 and 1, e.g. 0.99 for the 99th percentile
 
-def get_profiling_data() -> List[Tuple[str, str, int, float, float]]:
-    ...
+        :return:
+            A float of the upper bound of the bucket containing the
+            percentile, in seconds
+        """
+        ...
 
+    def reset(self) -> None:
+        ...
 
-def on_load(view_id: int) -> None:
-    ...
 
+profiling_percentiles: Tuple[float, ...] = (0.5, 0.9, 0.99, 0.999)
 
-def on_load_async(view_id: int) -> None:
-    ...
 
+@overload
+def get_profiling_data(percentiles: Literal[False] = False) -> List[Tuple[str, str, int, float, float]]:
+    """
+    :param percentiles:
+        If True, each entry has an extra element of a tuple of the p50, p90,
+        p99 and p999 latencies
 
-def on_revert(view_id: int) -> None:
+    :return:
+        A list of (event, plugin, count, max, sum) tuples. When
+        profile_sample_interval is greater than 1, only sampled calls are
+        counted.
+    """
     ...
 
 
-def on_revert_async(view_id: int) -> None:
+@overload
+def get_profiling_data(
+    percentiles: Literal[True],
+) -> List[Tuple[str, str, int, float, float, Tuple[float, ...]]]:
+    """
+    :param percentiles:
+        If True, each entry has an extra element of a tuple of the p50, p90,
+        p99 and p999 latencies
+
+    :return:
+        A list of (event, plugin, count, max, sum) tuples. When
+        profile_sample_interval is greater than 1, only sampled calls are
+        counted.
+    """
     ...
 
 
-def on_reload(view_id: int) -> None:
-    ...
+class TraceRecorder:
+    """
+    A bounded ring buffer of event handler timings, for seeing which handlers
+    ran in which order. Once full, the oldest entries are discarded, so it is
+    safe to leave running.
+    """
 
+    # (event, module, thread_id, start_ns, duration_ns)
+    entries: collections.deque[Tuple[str, str, int, int, int]]
 
-def on_reload_async(view_id: int) -> None:
-    ...
+    def __init__(self, capacity: int = 100000) -> None:
+        """
+        :param capacity:
+            The maximum number of entries to keep
+        """
+        ...
 
+    def record(self, event: str, module: str, start_ns: int, duration_ns: int) -> None:
+        ...
 
-def on_pre_close(view_id: int) -> None:
-    ...
+    def clear(self) -> None:
+        ...
 
+    def _thread_names(self) -> Dict[int | None, str]:
+        ...
 
-def on_close(view_id: int) -> None:
-    ...
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """
+        :return:
+            A dict in the Chrome Trace Event format, to be serialized as JSON
+            and loaded into chrome://tracing or Perfetto
+        """
+        ...
 
+    def to_speedscope(self) -> Dict[str, Any]:
+        """
+        :return:
+            A dict in the speedscope file format, with one evented profile
+            per thread, to be serialized as JSON
+        """
+        ...
 
-def on_pre_save(view_id: int) -> None:
-    ...
 
+def start_tracing(capacity: int = 100000) -> TraceRecorder:
+    """
+    Starts recording the timings of all decorated event handlers, and of
+    run_view_callbacks() and run_window_callbacks()
 
-def on_pre_save_async(view_id: int) -> None:
+    :param capacity:
+        The maximum number of entries to keep
+
+    :return:
+        The active TraceRecorder
+    """
     ...
 
 
-def on_post_save(view_id: int) -> None:
+def stop_tracing() -> None | TraceRecorder:
+    """
+    :return:
+        The TraceRecorder that was active, or None
+    """
     ...
 
 
-def on_post_save_async(view_id: int) -> None:
+class StallWatchdog:
+    """
+    Reports blocking event handlers and set_timeout() callbacks that run for
+    longer than a threshold, along with the stacks of all threads at that
+    point. The watched code only records when it started; all of the checking
+    is done on a separate thread.
+    """
+
+    threshold_ns: int
+    # Maps each thread id to a (start_ns, name, module, thread_id) tuple of the innermost callback currently
+    # running on that thread. Kept per thread as handlers such as parallel completion providers run off the
+    # main thread at the same time as main thread callbacks.
+    active: Dict[int, Tuple[int, str, str, int]]
+    reports: collections.deque[str]
+    _stopped: threading.Event
+    _thread: None | threading.Thread
+
+    def __init__(self, threshold: float = 1.0, max_reports: int = 20) -> None:
+        """
+        :param threshold:
+            The number of seconds a callback may block for before it is
+            reported
+
+        :param max_reports:
+            The number of most recent reports to keep in self.reports
+        """
+        ...
+
+    def start(self) -> None:
+        ...
+
+    def stop(self) -> None:
+        ...
+
+    def enter(self, name: str, mod: str) -> None | Tuple[int, str, str, int]:
+        """
+        Marks a callback as running on the current thread
+
+        :param name:
+            A unicode string of the name of the callback
+
+        :param mod:
+            A unicode string of the module the callback is defined in
+
+        :return:
+            The previously running callback on this thread, to pass to exit()
+        """
+        ...
+
+    def exit(self, prev_active: None | Tuple[int, str, str, int]) -> None:
+        """
+        Marks the callback started by the matching enter() as finished
+
+        :param prev_active:
+            The value returned by enter()
+        """
+        ...
+
+    def wrap(self, f: Callable[[], T]) -> Callable[[], T]:
+        """
+        :param f:
+            A callable taking no arguments, e.g. a set_timeout() callback
+
+        :return:
+            A callable that marks f as running while it is called
+        """
+        ...
+
+    def _run(self) -> None:
+        ...
+
+    def report(self, active: Tuple[int, str, str, int], elapsed_ns: int) -> None:
+        ...
+
+
+def start_stall_watchdog(threshold: float = 1.0) -> StallWatchdog:
+    """
+    Starts reporting blocking event handlers and set_timeout() callbacks that
+    run for longer than threshold seconds
+
+    :param threshold:
+        A float of the number of seconds
+
+    :return:
+        The running StallWatchdog
+    """
+    ...
+
+
+def stop_stall_watchdog() -> None:
+    ...
+
+
+def reset_profiling_data() -> None:
+    """
+    Clears the recorded statistics of all event handlers, so that the next
+    call to get_profiling_data() only covers the time since this call
+    """
+    ...
+
+
+def on_load(view_id: int) -> None:
+    ...
+
+
+def on_load_async(view_id: int) -> None:
+    ...
+
+
+def on_revert(view_id: int) -> None:
+    ...
+
+
+def on_revert_async(view_id: int) -> None:
+    ...
+
+
+def on_reload(view_id: int) -> None:
+    ...
+
+
+def on_reload_async(view_id: int) -> None:
+    ...
+
+
+def on_pre_close(view_id: int) -> None:
+    ...
+
+
+def on_close(view_id: int) -> None:
+    ...
+
+
+def on_pre_save(view_id: int) -> None:
+    ...
+
+
+def on_pre_save_async(view_id: int) -> None:
+    ...
+
+
+def on_post_save(view_id: int) -> None:
+    ...
+
+
+def on_post_save_async(view_id: int) -> None:
     ...
 
 
@@ -478,16 +1108,63 @@ def on_query_context(
     ...
 
 
+# Maps completion kinds to their normalised (kind, letter, name) form
+completion_kind_cache: Dict[CompletionKind, Tuple[int, int, str]] = {}
+
+
+def normalise_completion_kind(kind: CompletionKind) -> Tuple[int, int, str]:
+    ...
+
+
+def normalise_completion_item(c: sublime.CompletionItem) -> CompletionNormalized:
+    ...
+
+
+def normalise_completion_sequence(c: Sequence[str]) -> CompletionNormalized:
+    ...
+
+
 def normalise_completion(c: sublime.CompletionItem | str | Sequence[str]) -> CompletionNormalized:
     ...
 
 
+def normalise_completions(
+    completions: Iterable[sublime.CompletionItem | str | Sequence[str]],
+) -> List[CompletionNormalized]:
+    """
+    Normalises a whole list of completions at once, taking a fast path when
+    all of them are of the same type, as is the case for most providers
+
+    :param completions:
+        An iterable of CompletionItem objects, strs and sequences of strs
+
+    :return:
+        A list of normalised completion tuples
+    """
+    ...
+
+
+# When True, a completion request is answered after at most
+# completion_request_deadline_ms with the lists that are ready by then,
+# rather than waiting for every list. The host only accepts one set of
+# completions per request, so lists set later are dropped; a partial answer
+# is flagged with DYNAMIC_COMPLETIONS so the host re-queries as the user
+# types, giving the slow providers another chance.
+deadline_completions: bool = False
+
+# The number of milliseconds after which a completion request is answered
+# when deadline_completions is set, even if some lists have not been set
+completion_request_deadline_ms: int = 1000
+
+
 class MultiCompletionList:
     remaining_calls: int
     view_id: int
     req_id: int
     completions: List[CompletionNormalized]
     flags: int
+    finalised: bool
+    lock: threading.Lock
 
     def __init__(self, num_completion_lists: int, view_id: int, req_id: int) -> None:
         ...
@@ -499,6 +1176,180 @@ class MultiCompletionList:
     ) -> None:
         ...
 
+    def normalised_completions_ready(self, normalised: List[CompletionNormalized], flags: int) -> None:
+        ...
+
+    def finalise_after(self, timeout_ms: int) -> None:
+        """
+        Answers the request with the completions that are available after
+        timeout_ms, if some lists have still not been set by then
+
+        :param timeout_ms:
+            An int of the number of milliseconds
+        """
+        ...
+
+    def finalise(self) -> None:
+        ...
+
+
+# The number of milliseconds on_query_completions() providers decorated with
+# parallel_completions have to respond before their results are dropped
+completion_deadline_ms: int = 200
+
+completion_executor: None | concurrent.futures.ThreadPoolExecutor = None
+completion_executor_lock: threading.Lock = threading.Lock()
+
+
+def parallel_completions(event_handler: T_AnyCallable) -> T_AnyCallable:
+    """
+    Decorator for on_query_completions() methods that are safe to be run on a
+    worker thread. Such providers run concurrently with each other and with
+    the remaining providers, and whatever they haven't returned within
+    completion_deadline_ms is dropped.
+
+    :param event_handler:
+        The on_query_completions() method
+
+    :return:
+        The method, marked to be run in parallel
+    """
+    ...
+
+
+def get_completion_executor() -> concurrent.futures.ThreadPoolExecutor:
+    ...
+
+
+class DeadlineCompletionList:
+    """
+    Receives the result of an on_query_completions() provider run on a worker
+    thread, and passes it to self.completion_list unless the deadline passes
+    first, in which case an empty list is passed instead.
+
+    The list is only ever set on the main thread, where on_query_completions()
+    sets its target, as CompletionList doesn't guard against the two
+    happening at once. The deadline is timed on the main thread too, as the
+    async thread may be held up by the very handlers it is meant to cut off.
+    """
+
+    completion_list: sublime.CompletionList
+    finished: bool
+    # Whether the deadline passed before the provider produced a result
+    expired: bool
+    lock: threading.Lock
+
+    def __init__(self, deadline_ms: int) -> None:
+        ...
+
+    def completions_ready(
+        self,
+        completions: Iterable[sublime.CompletionItem | str | Sequence[str]],
+        flags: int,
+        expired: bool = False,
+    ) -> None:
+        ...
+
+    def expire(self) -> None:
+        ...
+
+    def provider_done(self, future: concurrent.futures.Future[Any]) -> None:
+        ...
+
+
+# Maps view ids to the (context, prefix, change count, results) of the last
+# completion query in the view, where results maps each prefix_refinable
+# provider to the (normalised completions, flags) it produced
+completion_refinement_cache: Dict[
+    int,
+    Tuple[
+        None | Tuple[int, int],
+        str,
+        int,
+        Dict[Callable[..., Any], Tuple[List[CompletionNormalized], int]],
+    ],
+] = {}
+
+
+def prefix_refinable(event_handler: T_AnyCallable) -> T_AnyCallable:
+    """
+    Decorator for on_query_completions() methods whose completions for a
+    prefix are always a subset of those for any shorter prefix at the same
+    location. While the user keeps typing the same word, the previous
+    completions are filtered and reused instead of calling the method again.
+
+    :param event_handler:
+        The on_query_completions() method
+
+    :return:
+        The method, marked as prefix refinable
+    """
+    ...
+
+
+def refine_completions(completions: List[CompletionNormalized], prefix: str) -> List[CompletionNormalized]:
+    """
+    Keeps the normalised completions whose trigger contains the characters of
+    prefix in order, ignoring case, as the completion popup would
+
+    :param completions:
+        A list of normalised completion tuples
+
+    :param prefix:
+        The str the user has typed
+
+    :return:
+        A list of the matching completion tuples
+    """
+    ...
+
+
+class CachedCompletionList:
+    """
+    Stands in for the CompletionList of a prefix_refinable provider, passing
+    on completions that have already been normalised
+    """
+
+    completions: List[CompletionNormalized]
+    flags: int
+
+    def __init__(self, completions: List[CompletionNormalized], flags: int) -> None:
+        ...
+
+    def _set_target(self, target: MultiCompletionList) -> None:
+        ...
+
+
+class RefinementRecorder:
+    """
+    Sits between the CompletionList of a prefix_refinable provider and the
+    MultiCompletionList, recording the completions for later queries. The
+    empty list a parallel provider gets when it misses its deadline isn't
+    recorded, nor are completions flagged with DYNAMIC_COMPLETIONS, which
+    ask for the provider to be queried again as the user types.
+    """
+
+    results: Dict[Callable[..., Any], Tuple[List[CompletionNormalized], int]]
+    key: Callable[..., Any]
+    target: MultiCompletionList
+    deadline: None | DeadlineCompletionList
+
+    def __init__(
+        self,
+        results: Dict[Callable[..., Any], Tuple[List[CompletionNormalized], int]],
+        key: Callable[..., Any],
+        target: MultiCompletionList,
+        deadline: None | DeadlineCompletionList = None,
+    ) -> None:
+        ...
+
+    def completions_ready(
+        self,
+        completions: Iterable[sublime.CompletionItem | str | Sequence[str]],
+        flags: int,
+    ) -> None:
+        ...
+
 
 def on_query_completions(
     view_id: int,
@@ -633,17 +1484,17 @@ class CommandInputHandler(Generic[T_InputType]):
         """
         ...
 
-    def cancel(self) -> None:
+    def cancel(self) -> None | Awaitable[None]:
         """Called when the input handler is canceled, either by the user pressing backspace or escape."""
         ...
 
     @overload
-    def confirm(self, arg: T_InputType) -> None:
+    def confirm(self, arg: T_InputType) -> None | Awaitable[None]:
         """Called when the input is accepted, after the user has pressed enter and the text has been validated."""
         ...
 
     @overload
-    def confirm(self, arg: T_InputType, event: EventDict) -> None:
+    def confirm(self, arg: T_InputType, event: EventDict) -> None | Awaitable[None]:
         """Called when the input is accepted, after the user has pressed enter and the text has been validated."""
         ...
 
@@ -829,7 +1680,11 @@ class WindowCommand(Command):
 
 
 class TextCommand(Command):
-    """TextCommands are instantiated once per view. The View object may be retrieved via `self.view`"""
+    """
+    TextCommands are instantiated once per view. The View object may be retrieved via `self.view`
+
+    Unlike other commands, run() may not be a coroutine, as the Edit object is only valid until it returns.
+    """
 
     view: sublime.View
 
@@ -873,6 +1728,15 @@ class ViewEventListener:
         """
         ...
 
+    @classmethod
+    def applicable_settings_keys(cls) -> None | Iterable[str]:
+        """
+        Returns the settings keys `is_applicable()` depends on. When they are declared,
+        applicability is only re-evaluated if one of them changed value.
+        The default implementation returns None, which means any settings change.
+        """
+        ...
+
     def __init__(self, view: sublime.View) -> None:
         ...
 
@@ -911,8 +1775,21 @@ class TextChangeListener:
 
     on_reload_async():
         Async version of on_reload_async.
+
+    Setting columnar_changes to True on a subclass passes the changes to
+    on_text_changed() and on_text_changed_async() as a TextChangeBatch,
+    rather than a list of TextChange. The batch is built from the list the
+    host passes, so this trades extra CPU time on every change for holding
+    the changes compactly; it only pays off for listeners that keep batches
+    around or scan them repeatedly.
+
+    Setting coalesce_changes to True on a subclass merges all the batches of
+    changes that are pending by the time on_text_changed_async() runs into
+    one list of non-overlapping changes, which it is called with once.
     """
 
+    columnar_changes: bool
+    coalesce_changes: bool
     __key: None | int
     buffer: None | sublime.Buffer
 
@@ -947,6 +1824,557 @@ class TextChangeListener:
         ...
 
 
+class TextChangeBatch:
+    """
+    A batch of text changes, held as one array per attribute.
+
+    Passed to the on_text_changed() and on_text_changed_async() callbacks of
+    TextChangeListener classes setting columnar_changes, in place of a list of
+    TextChange. The attributes of the HistoricPositions a and b of the changes
+    are in the a_* and b_* arrays, and the inserted strs are concatenated in
+    text, with change i's at text[text_offsets[i]:text_offsets[i + 1]].
+
+    Indexing or iterating over the batch creates TextChange objects on demand,
+    so it may be used in place of the list.
+
+    Converting a list to a batch costs CPU time, in exchange for the batch
+    taking far less memory than the TextChange objects.
+    """
+
+    a_pt: array.array[int]
+    a_row: array.array[int]
+    a_col: array.array[int]
+    a_col_utf16: array.array[int]
+    a_col_utf8: array.array[int]
+    b_pt: array.array[int]
+    b_row: array.array[int]
+    b_col: array.array[int]
+    b_col_utf16: array.array[int]
+    b_col_utf8: array.array[int]
+    len_utf16: array.array[int]
+    len_utf8: array.array[int]
+    text: Str
+    text_offsets: array.array[int]
+
+    def __init__(self, changes: Sequence[sublime.TextChange] = ()) -> None:
+        """
+        :param changes:
+            A list of TextChange
+        """
+        ...
+
+    def __len__(self) -> int:
+        ...
+
+    @overload
+    def __getitem__(self, index: int) -> sublime.TextChange:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[sublime.TextChange]:
+        ...
+
+    def __iter__(self) -> Iterator[sublime.TextChange]:
+        ...
+
+    def __repr__(self) -> Str:
+        ...
+
+    def str(self, index: int) -> Str:
+        """The str inserted by a change, without creating the TextChange."""
+        ...
+
+    def texts(self) -> Iterator[Str]:
+        """An iterator over the strs inserted by each change."""
+        ...
+
+
+def deliver_columnar(event_handler: T_AnyCallable) -> T_AnyCallable:
+    """
+    Decorator passing the list of TextChange to an on_text_changed() or
+    on_text_changed_async() method as a TextChangeBatch. Each list is only
+    converted once: on_text_changed() hands the batch it built on to
+    on_text_changed_async(), which only converts lists it wasn't handed.
+
+    :param event_handler:
+        The event handler method - must be an unbound method
+
+    :return:
+        The decorated method
+    """
+    ...
+
+
+def queue_text_changes(cls: Type[TextChangeListener]) -> None:
+    """
+    Has the on_text_changed() method of a TextChangeListener class setting
+    coalesce_changes queue each batch of changes for on_text_changed_async(),
+    adding the method if the class doesn't define it.
+
+    A subclass of such a class gets its own queuing method when it overrides
+    on_text_changed(), so each batch is only queued by the outermost call,
+    not again by base class methods called through super().
+
+    :param cls:
+        The TextChangeListener class
+    """
+    ...
+
+
+# The number of pending changes above which on_text_changed_async() is
+# called with each batch in turn rather than merging them, as the time
+# merge_text_changes() takes grows with the square of the number of changes
+coalesce_changes_limit: int = 256
+
+
+def deliver_coalesced(event_handler: T_AnyCallable) -> T_AnyCallable:
+    """
+    Decorator for the on_text_changed_async() method of a TextChangeListener
+    class setting coalesce_changes. The first call merges every batch queued
+    by on_text_changed() so far, and the calls for the batches it included
+    are skipped. If the batches hold more than coalesce_changes_limit changes
+    in total, they are passed on one at a time instead.
+
+    :param event_handler:
+        The event handler method - must be an unbound method
+
+    :return:
+        The decorated method
+    """
+    ...
+
+
+def utf16_len(text: str) -> int:
+    ...
+
+
+def advance_position(pos: PositionTuple, text: str) -> PositionTuple:
+    """
+    :param pos:
+        A (pt, row, col, col_utf16, col_utf8) tuple
+
+    :param text:
+        A str inserted at pos
+
+    :return:
+        The (pt, row, col, col_utf16, col_utf8) tuple of the end of text
+    """
+    ...
+
+
+def rebase_position(pos: PositionTuple, old_end: PositionTuple, new_end: PositionTuple) -> PositionTuple:
+    """
+    :param pos:
+        A (pt, row, col, col_utf16, col_utf8) tuple at or after old_end
+
+    :param old_end:
+        The position tuple of the end of a region, before it was replaced
+
+    :param new_end:
+        The position tuple of the end of the text the region was replaced
+        with
+
+    :return:
+        The position tuple pos moves to
+    """
+    ...
+
+
+class MergedTextChange:
+    """
+    A region of the oldest version of the text, and the text it has been
+    replaced with in the current version, used by merge_text_changes()
+    """
+
+    old_a: PositionTuple
+    old_b: PositionTuple
+    len_utf16: int
+    len_utf8: int
+    start: PositionTuple
+    end: PositionTuple
+    text: str
+
+    def __init__(
+        self,
+        old_a: PositionTuple,
+        old_b: PositionTuple,
+        len_utf16: int,
+        len_utf8: int,
+        start: PositionTuple,
+        text: str,
+    ) -> None:
+        ...
+
+
+def merge_text_changes(
+    batches: List[List[sublime.TextChange] | TextChangeBatch],
+) -> List[sublime.TextChange]:
+    """
+    Merges consecutive batches of changes into the fewest changes having the
+    same effect, none of which overlap or touch. Their positions are all in
+    the text from before the first batch, and they are ordered from the end
+    of the text to the start, so may be applied in turn like any batch.
+
+    :param batches:
+        A list of lists of TextChange, or TextChangeBatch
+
+    :return:
+        A list of TextChange
+    """
+    ...
+
+
+class TextBufferMirror(TextChangeListener):
+    """
+    A text change listener keeping a copy of the text of its buffer.
+
+    The copy is updated from the changes passed to on_text_changed(), rather
+    than being read out of the buffer, so plugins needing the whole document
+    after every modification don't copy it each time. The text is held in
+    chunks of at most CHUNK_SIZE characters, so an edit only rebuilds the
+    chunks it touches, and reading a region only joins the chunks it spans.
+
+    The copy is reread from the buffer when attaching, and on revert and
+    reload. It may be read from any thread.
+
+    Subclasses overriding any of the callbacks must call the base
+    implementation.
+    """
+
+    CHUNK_SIZE: int
+    lock: threading.Lock
+    chunks: List[str]
+    offsets: List[int]
+    length: int
+    snapshot: None | str
+
+    def __init__(self) -> None:
+        ...
+
+    def attach(self, buffer: sublime.Buffer) -> None:
+        ...
+
+    def resync(self) -> None:
+        """Replace the copy with the current text of the buffer."""
+        ...
+
+    def on_text_changed(self, changes: List[sublime.TextChange] | TextChangeBatch) -> None:
+        ...
+
+    def on_revert(self) -> None:
+        ...
+
+    def on_reload(self) -> None:
+        ...
+
+    def _locate(self, pt: int) -> int:
+        ...
+
+    def _replace(self, a: int, b: int, text: str) -> None:
+        ...
+
+    def size(self) -> int:
+        """The number of characters in the copy of the buffer."""
+        ...
+
+    def substr(self, x: sublime.Region | Point) -> str:
+        """
+        The text of a region, or the character at a point.
+
+        :param x:
+            A sublime.Region or an int point
+
+        :return:
+            A str
+        """
+        ...
+
+    def text(self) -> str:
+        """
+        The whole text of the copy of the buffer.
+
+        The str is cached until the next change, so repeated calls are cheap.
+        """
+        ...
+
+
+class TextLineIndex(TextChangeListener):
+    """
+    A text change listener indexing where the lines of its buffer start.
+
+    Converts between points and (row, col) pairs without calling into the
+    API for each one, and may be used from any thread, so plugins converting
+    thousands of positions can do so in one call off the main thread.
+
+    The length of each line, including its newline, is kept in an array. A
+    change only replaces the lengths of the rows it spans, which are read
+    from its HistoricPositions. The sorted array of line starts used for
+    lookups is rebuilt from the first modified line by the next conversion.
+
+    The index is rebuilt from the buffer when attaching, and on revert and
+    reload.
+
+    Subclasses overriding any of the callbacks must call the base
+    implementation.
+    """
+
+    lock: threading.Lock
+    lengths: array.array[int]
+    starts: array.array[int]
+    dirty_row: int
+
+    def __init__(self) -> None:
+        ...
+
+    def attach(self, buffer: sublime.Buffer) -> None:
+        ...
+
+    def resync(self) -> None:
+        """Rebuild the index from the current text of the buffer."""
+        ...
+
+    def _reset(self, text: str) -> None:
+        ...
+
+    def on_text_changed(self, changes: List[sublime.TextChange] | TextChangeBatch) -> None:
+        ...
+
+    def on_revert(self) -> None:
+        ...
+
+    def on_reload(self) -> None:
+        ...
+
+    def _apply(self, a_row: int, a_col: int, b_row: int, b_col: int, text: str) -> None:
+        ...
+
+    def _line_starts(self) -> array.array[int]:
+        ...
+
+    def line_count(self) -> int:
+        """The number of lines in the buffer."""
+        ...
+
+    def size(self) -> int:
+        """The number of characters in the buffer."""
+        ...
+
+    def rowcol(self, pt: Point) -> Tuple[int, int]:
+        """Convert a point to a 0-based (row, col) pair, like View.rowcol()."""
+        ...
+
+    def rowcols(self, points: Iterable[Point]) -> List[Tuple[int, int]]:
+        """
+        Convert points to 0-based (row, col) pairs.
+
+        :param points:
+            An iterable of int points
+
+        :return:
+            A list of (int, int) tuples
+        """
+        ...
+
+    def _rowcols(self, points: Iterable[Point]) -> List[Tuple[int, int]]:
+        ...
+
+    def text_point(self, row: int, col: int, *, clamp_column: bool = False) -> Point:
+        """Convert a 0-based row and column to a point, like View.text_point()."""
+        ...
+
+    def text_points(self, rowcols: Iterable[Tuple[int, int]], *, clamp_column: bool = False) -> List[Point]:
+        """
+        Convert 0-based (row, col) pairs to points.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :param clamp_column:
+            A bool, if col should be restricted to valid values for the row
+
+        :return:
+            A list of int points
+        """
+        ...
+
+    def _text_points(self, rowcols: Iterable[Tuple[int, int]], clamp_column: bool) -> List[Point]:
+        ...
+
+
+def scan_wide_chars(text: str, col: int) -> List[Tuple[int, int, int]]:
+    """
+    Finds the characters of a line that take more than one UTF-16 or UTF-8
+    code unit
+
+    :param text:
+        The str of (part of) a line
+
+    :param col:
+        The int column text starts at
+
+    :return:
+        A list of (col, extra UTF-16 units, extra UTF-8 units) tuples
+    """
+    ...
+
+
+def column_table(entries: List[Tuple[int, int, int]]) -> ColumnTable:
+    """
+    Builds the lookup table of a line from its scan_wide_chars() entries
+
+    :param entries:
+        A list of (col, extra UTF-16 units, extra UTF-8 units) tuples
+
+    :return:
+        None if the line is ASCII only, otherwise a tuple of the columns of
+        the wide characters, the UTF-16 and UTF-8 units to add to a column
+        before each of them, and the UTF-16 and UTF-8 columns after each
+    """
+    ...
+
+
+def column_table_entries(table: ColumnTable, start: int, end: None | int, shift: int) -> List[Tuple[int, int, int]]:
+    ...
+
+
+class TextColumnIndex(TextLineIndex):
+    """
+    A TextLineIndex which also converts columns to and from UTF-16 and
+    UTF-8 code units, such as for the positions used by language servers.
+
+    ASCII only lines need no table. Other lines have a table of the columns
+    of their non-ASCII characters, which a change splits and joins using the
+    columns of its HistoricPositions and the text it inserted.
+    """
+
+    columns: List[ColumnTable]
+
+    def __init__(self) -> None:
+        ...
+
+    def _reset(self, text: str) -> None:
+        ...
+
+    def _apply(self, a_row: int, a_col: int, b_row: int, b_col: int, text: str) -> None:
+        ...
+
+    def _encode(self, rowcols: Iterable[Tuple[int, int]], unit: int) -> List[Tuple[int, int]]:
+        ...
+
+    def _decode(self, rowcols: Iterable[Tuple[int, int]], unit: int) -> List[Tuple[int, int]]:
+        ...
+
+    def rowcol_utf16(self, pt: Point) -> Tuple[int, int]:
+        """
+        Convert a point to a 0-based (row, col) pair, with col in UTF-16
+        code units, like View.rowcol_utf16().
+        """
+        ...
+
+    def rowcols_utf16(self, points: Iterable[Point]) -> List[Tuple[int, int]]:
+        """
+        Convert points to 0-based (row, col) pairs, with col in UTF-16
+        code units.
+
+        :param points:
+            An iterable of int points
+
+        :return:
+            A list of (int, int) tuples
+        """
+        ...
+
+    def rowcol_utf8(self, pt: Point) -> Tuple[int, int]:
+        """
+        Convert a point to a 0-based (row, col) pair, with col in UTF-8
+        code units, like View.rowcol_utf8().
+        """
+        ...
+
+    def rowcols_utf8(self, points: Iterable[Point]) -> List[Tuple[int, int]]:
+        """
+        Convert points to 0-based (row, col) pairs, with col in UTF-8
+        code units.
+
+        :param points:
+            An iterable of int points
+
+        :return:
+            A list of (int, int) tuples
+        """
+        ...
+
+    def text_point_utf16(self, row: int, col: int, *, clamp_column: bool = False) -> Point:
+        """
+        Convert a 0-based row and UTF-16 column to a point, like
+        View.text_point_utf16().
+        """
+        ...
+
+    def text_points_utf16(self, rowcols: Iterable[Tuple[int, int]], *, clamp_column: bool = False) -> List[Point]:
+        """
+        Convert 0-based (row, col) pairs, with col in UTF-16 code units,
+        to points.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :param clamp_column:
+            A bool, if col should be restricted to valid values for the row
+
+        :return:
+            A list of int points
+        """
+        ...
+
+    def text_point_utf8(self, row: int, col: int, *, clamp_column: bool = False) -> Point:
+        """
+        Convert a 0-based row and UTF-8 column to a point, like
+        View.text_point_utf8().
+        """
+        ...
+
+    def text_points_utf8(self, rowcols: Iterable[Tuple[int, int]], *, clamp_column: bool = False) -> List[Point]:
+        """
+        Convert 0-based (row, col) pairs, with col in UTF-8 code units,
+        to points.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :param clamp_column:
+            A bool, if col should be restricted to valid values for the row
+
+        :return:
+            A list of int points
+        """
+        ...
+
+    def utf16_to_utf8(self, rowcols: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Convert 0-based (row, col) pairs from UTF-16 to UTF-8 columns.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :return:
+            A list of (int, int) tuples
+        """
+        ...
+
+    def utf8_to_utf16(self, rowcols: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """
+        Convert 0-based (row, col) pairs from UTF-8 to UTF-16 columns.
+
+        :param rowcols:
+            An iterable of (int, int) tuples
+
+        :return:
+            A list of (int, int) tuples
+        """
+        ...
+
+
 class MultizipImporter(importlib.abc.MetaPathFinder):
     loaders: List[importlib.abc.Loader]
 